@@ -1,15 +1,18 @@
 from __future__ import annotations
-import gender_guesser.detector as gender
+try:
+    import gender_guesser.detector as gender   # optional: names outside names.json
+except ImportError:
+    gender = None
 from random import choice
 from google.cloud import texttospeech
 import hashlib, pathlib
 
-import os, random, json, time, tempfile, re
+import os, random, json, time, tempfile, re, copy
 import pyaudio, wave
 import google.generativeai as genai
+from google.generativeai import caching
 from dotenv import load_dotenv
-from sentence_transformers import util
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import re
 import io
@@ -20,20 +23,30 @@ from memory.utils_memory import Message
  # ── stdlib ─────────────────────────────────────────────
 import sys, threading
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, Future, TimeoutError as FutureTimeout
 
 import queue, struct, math, threading, wave
 import pyaudio, numpy as np
 from google.cloud import speech
 from google.oauth2    import service_account
-import concurrent.futures, queue
+import sqlite3, asyncio, functools, itertools, datetime
+from enum import IntEnum
+from collections import OrderedDict
+from contextlib import contextmanager
+from google.api_core import exceptions as gexc
+try:
+    import faiss                    # optional: ANN speaker index for big rosters
+except ImportError:
+    faiss = None
 
 feedback_queue = queue.Queue()
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
 
 
-CACHE_FILE = Path("npc_cache.json")        # disk stash for personalities
+CACHE_FILE = Path("npc_cache.json")        # legacy single-topic stash (imported once)
+ROSTER_DB  = Path("roster_cache.sqlite")   # per-topic rosters, vectors and voices
 RESET_CACHE = "--reset" in sys.argv        # run:  python app.py --reset
+EMBED_DB   = Path("embed_cache.sqlite")    # content-addressed embedding store
+NAMES_FILE = Path(__file__).with_name("names.json")  # bundled first names by region / gender
 # ── mic / STT globals ──────────────────────────────────────────
 voice_enabled   = False           # toggled by /voice
 voice_queue     = queue.Queue()   # (speaker, text) tuples for /idle
@@ -72,7 +85,27 @@ MALE_VOICES = [
 ]
 
 _voice_pool = {"female": FEMALE_VOICES.copy(), "male": MALE_VOICES.copy()}
-_gender_det = gender.Detector(case_sensitive=False)
+
+_voice_local = threading.local()
+
+def reset_voice_pool():
+    """Every voice is free again (a new roster is about to be built)."""
+    _voice_pool["female"][:] = FEMALE_VOICES
+    _voice_pool["male"][:]   = MALE_VOICES
+
+def _voices() -> dict:
+    """The voice pool NPCs built on this thread draw from."""
+    return getattr(_voice_local, "pool", None) or _voice_pool
+
+@contextmanager
+def private_voice_pool():
+    """Roster builds off the request thread get their own full pool."""
+    _voice_local.pool = {"female": FEMALE_VOICES.copy(), "male": MALE_VOICES.copy()}
+    try:
+        yield
+    finally:
+        _voice_local.pool = None
+_gender_det = gender.Detector(case_sensitive=False) if gender is not None else None
 
 # Load environment variables
 load_dotenv()
@@ -88,15 +121,615 @@ AUDIO_CONFIG = {
 
 # Gemini API setup
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+BASE_GENERATION_CONFIG = {
+    "temperature": 0.9,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
 gemini_model = genai.GenerativeModel("gemini-2.0-flash",
-    generation_config={
-        "temperature": 0.9,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 8192,
-    }
+    generation_config=BASE_GENERATION_CONFIG
 )
 
+# ── Work scheduler ─────────────────────────────────────────────────────
+class Priority(IntEnum):
+    """Work classes; lower value is served first."""
+    INTERACTIVE = 0      # /chat reply generation
+    REPLY_TTS   = 1      # audio for that reply
+    IDLE        = 2      # idle rounds, nudges, speculation
+    FEEDBACK    = 3      # coach feedback
+    ROSTER      = 4      # names / personas for /topic
+
+_prio_local = threading.local()
+
+def current_priority() -> Priority:
+    """Priority of the work running on this thread (request threads = INTERACTIVE)."""
+    return getattr(_prio_local, "value", Priority.INTERACTIVE)
+
+@contextmanager
+def run_as(priority: Priority):
+    prev = current_priority()
+    _prio_local.value = priority
+    try:
+        yield
+    finally:
+        _prio_local.value = prev
+
+def with_priority(priority: Priority, fn):
+    """Wrap <fn> so it runs under <priority> on whichever thread executes it."""
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        with run_as(priority):
+            return fn(*args, **kwargs)
+    return run
+
+class PriorityGate:
+    """
+    Shared slots (LLM or TTS calls) handed out by priority class.
+      • a free slot goes to the best waiting class that is under its own cap
+      • FIFO within a class
+      • <reserve> slots are never given to IDLE-or-lower work, so a user
+        turn always finds one free even while background work is busy
+    """
+    def __init__(self, total: int, caps: dict, reserve: int = 1):
+        self.total    = total
+        self.caps     = caps
+        self.reserve  = min(reserve, total - 1)
+        self._cv      = threading.Condition()
+        self._running = {p: 0 for p in Priority}
+        self._waiting = []                      # (priority, seq)
+        self._seq     = itertools.count()
+        self.stats    = {"granted": 0, "waited": 0, "timeouts": 0}
+
+    def _admissible(self, priority) -> bool:
+        busy = sum(self._running.values())
+        if busy >= self.total or self._running[priority] >= self.caps.get(priority, self.total):
+            return False
+        if priority >= Priority.IDLE:
+            background = sum(n for p, n in self._running.items() if p >= Priority.IDLE)
+            return background < self.total - self.reserve
+        return True
+
+    def acquire(self, priority: Priority, timeout: float | None = None) -> bool:
+        me       = (priority, next(self._seq))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            self._waiting.append(me)
+            try:
+                waited = False
+                while min((w for w in self._waiting if self._admissible(w[0])), default=None) != me:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        return False
+                    waited = True
+                    self._cv.wait(remaining)
+                self._running[priority] += 1
+                self.stats["granted"] += 1
+                self.stats["waited"]  += waited
+                return True
+            finally:
+                self._waiting.remove(me)
+                self._cv.notify_all()
+
+    def release(self, priority: Priority):
+        with self._cv:
+            self._running[priority] -= 1
+            self._cv.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: float | None = None):
+        """Hold one slot at the current thread's priority."""
+        priority = current_priority()
+        if not self.acquire(priority, timeout):
+            raise TimeoutError("no free slot before deadline")
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+class BackgroundJobs:
+    """
+    One small worker pool per background class. Submitting with a <key>
+    cancels the previous job under that key if it hasn't started yet
+    (e.g. coach feedback for a message the user has already moved past).
+    """
+    def __init__(self, workers: dict):
+        self._pools  = {p: ThreadPoolExecutor(max_workers=n, thread_name_prefix=p.name.lower())
+                        for p, n in workers.items()}
+        self._latest = {}
+        self._lock   = threading.Lock()
+        self.stats   = {"submitted": 0, "superseded": 0}
+
+    def submit(self, priority: Priority, fn, *args, key: str | None = None):
+        fut = self._pools[priority].submit(with_priority(priority, fn), *args)
+        with self._lock:
+            self.stats["submitted"] += 1
+            if key is not None:
+                old, self._latest[key] = self._latest.get(key), fut
+                if old is not None and old.cancel():
+                    self.stats["superseded"] += 1
+        return fut
+
+background = BackgroundJobs({Priority.IDLE: 1, Priority.FEEDBACK: 2, Priority.ROSTER: 1})
+
+# ── Rate limits & request coalescing ──────────────────────────────────
+class TokenBucket:
+    """
+    Process-wide requests-per-minute limiter.
+    take() blocks until a token is free, or returns False once <timeout>
+    would be exceeded. <per_minute> <= 0 disables the bucket.
+    """
+    def __init__(self, per_minute: int, burst: int | None = None):
+        self.rate     = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 6)       # ~10 s worth
+        self.tokens   = float(self.capacity)
+        self.updated  = time.monotonic()
+        self._cv      = threading.Condition()
+        self.stats    = {"granted": 0, "throttled": 0, "rejected": 0,
+                         "waiting": 0, "max_waiting": 0}
+
+    def take(self, timeout: float | None = None) -> bool:
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            queued = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.stats["granted"] += 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+                    if deadline is not None and now + wait > deadline:
+                        self.stats["rejected"] += 1
+                        return False
+                    if not queued:
+                        queued = True
+                        self.stats["throttled"]  += 1
+                        self.stats["waiting"]    += 1
+                        self.stats["max_waiting"] = max(self.stats["max_waiting"], self.stats["waiting"])
+                    self._cv.wait(wait)
+            finally:
+                if queued:
+                    self.stats["waiting"] -= 1
+
+rate_limits = {
+    "generate": TokenBucket(int(os.getenv("GENERATE_RPM", 120))),
+    "embed"   : TokenBucket(int(os.getenv("EMBED_RPM", 600))),
+    "tts"     : TokenBucket(int(os.getenv("TTS_RPM", 300))),
+    "stt"     : TokenBucket(int(os.getenv("STT_RPM", 300))),
+}
+
+def rate_limit(kind: str, timeout: float | None = None):
+    """Wait for a <kind> token; TimeoutError if none frees up in time."""
+    if not rate_limits[kind].take(timeout):
+        raise TimeoutError(f"{kind} rate limit: no token before deadline")
+
+COALESCE_WAIT = float(os.getenv("COALESCE_WAIT", 30))   # default follower wait, seconds
+
+class Coalescer:
+    """
+    Identical in-flight requests share one call; followers get the leader's
+    result, waiting at most their own <timeout> for it.
+    """
+    def __init__(self):
+        self._inflight = {}
+        self._lock     = threading.Lock()
+        self.stats     = {"led": 0, "joined": 0, "timed_out": 0}
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def run(self, key: str, fn, timeout: float | None = COALESCE_WAIT):
+        with self._lock:
+            fut    = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+            self.stats["led" if leader else "joined"] += 1
+        if not leader:
+            try:
+                return fut.result(timeout=timeout)
+            except FutureTimeout:
+                with self._lock:
+                    self.stats["timed_out"] += 1
+                raise TimeoutError("coalesced request: leader did not finish before deadline") from None
+        try:
+            result = fn()
+            fut.set_result(result)
+            return result
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+coalesce = {kind: Coalescer() for kind in ("generate", "embed", "tts")}
+
+# ── LLM client ─────────────────────────────────────────────────────────
+LLM_TIMEOUT     = float(os.getenv("LLM_TIMEOUT", 20))     # seconds, whole call incl. retries
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 8))    # in-flight generate calls
+LLM_RETRIES     = int(os.getenv("LLM_RETRIES", 3))
+
+_RETRYABLE = (gexc.ResourceExhausted, gexc.ServiceUnavailable, gexc.DeadlineExceeded,
+              gexc.InternalServerError, gexc.TooManyRequests, TimeoutError)
+
+# Generation profiles: per call type output cap / sampling / format.
+# Merged over BASE_GENERATION_CONFIG; a call's own generation_config wins.
+GENERATION_PROFILES = {
+    "reply"      : {"temperature": 0.9,  "max_output_tokens": 256},
+    "nudge"      : {"temperature": 0.95, "max_output_tokens": 96},
+    "group"      : {"temperature": 0.9,  "max_output_tokens": 768},
+    "emotion"    : {"temperature": 0.2,  "max_output_tokens": 24,
+                    "response_mime_type": "application/json"},
+    "feedback"   : {"temperature": 0.7,  "max_output_tokens": 256},
+    "summary"    : {"temperature": 0.3,  "max_output_tokens": 320},
+    "name"       : {"temperature": 0.95, "max_output_tokens": 16, "top_p": 0.98,
+                    "stop_sequences": ["\n"]},
+    "personality": {"temperature": 0.9,  "max_output_tokens": 1536,
+                    "response_mime_type": "application/json"},
+    "roster"     : {"temperature": 0.95, "max_output_tokens": 4096},
+    "transcribe" : {"temperature": 0.0,  "max_output_tokens": 1024},
+    "voice_tone" : {"temperature": 0.0,  "max_output_tokens": 8, "stop_sequences": ["\n"]},
+}
+
+def profile_config(profile: str | None, overrides: dict | None = None) -> dict | None:
+    """Generation config for <profile> with <overrides> applied on top."""
+    if profile is None:
+        return overrides
+    return {**BASE_GENERATION_CONFIG, **GENERATION_PROFILES[profile], **(overrides or {})}
+
+class LLMClient:
+    """
+    Shared wrapper around one Gemini model:
+      • per-call deadline (each attempt gets what is left of it)
+      • bounded, priority-ordered concurrency (see PriorityGate)
+      • exponential backoff with full jitter on quota / 5xx / timeouts
+      • per-profile latency / token accounting (see GENERATION_PROFILES)
+    generate() blocks; `await agenerate()` runs the same path off-loop.
+    """
+    def __init__(self, model, concurrency: int, timeout: float, retries: int):
+        self.model    = model
+        self.timeout  = timeout
+        self.retries  = retries
+        self._gate    = PriorityGate(concurrency, {
+                            Priority.IDLE:     max(1, concurrency // 2),
+                            Priority.FEEDBACK: 1,
+                            Priority.ROSTER:   max(1, concurrency // 2)})
+        self._lock    = threading.Lock()
+        self.stats    = {"calls": 0, "retries": 0, "timeouts": 0, "exhausted": 0, "failures": 0}
+        self.profile_stats = {}   # profile → calls / latency / token totals
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _record(self, profile: str | None, started: float, usage):
+        """Accumulate latency and token counts for one successful call."""
+        ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            st = self.profile_stats.setdefault(profile or "default", {
+                "calls": 0, "latency_ms": 0.0, "max_latency_ms": 0.0,
+                "prompt_tokens": 0, "output_tokens": 0})
+            st["calls"]          += 1
+            st["latency_ms"]     += ms
+            st["max_latency_ms"]  = max(st["max_latency_ms"], ms)
+            if usage is not None:
+                st["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+                st["output_tokens"] += getattr(usage, "candidates_token_count", 0) or 0
+
+    def profile_report(self) -> dict:
+        """Per-profile averages for /stats."""
+        with self._lock:
+            return {name: {"calls": st["calls"],
+                           "avg_latency_ms": round(st["latency_ms"] / st["calls"], 1),
+                           "max_latency_ms": round(st["max_latency_ms"], 1),
+                           "avg_prompt_tokens": round(st["prompt_tokens"] / st["calls"], 1),
+                           "avg_output_tokens": round(st["output_tokens"] / st["calls"], 1)}
+                    for name, st in self.profile_stats.items() if st["calls"]}
+
+    def _give_up(self, last: Exception | None, what: str):
+        """
+        Out of retries or time: re-raise the last quota / 5xx error as is
+        (counted as "exhausted"); deadline-type failures become TimeoutError.
+        """
+        if last is None or isinstance(last, (TimeoutError, gexc.DeadlineExceeded)):
+            self._count("timeouts")
+            raise TimeoutError(f"{what} exceeded its deadline / retry budget") from last
+        self._count("exhausted")
+        raise last
+
+    @staticmethod
+    def backoff(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+        """Full-jitter exponential delay for retry number <attempt> (0-based)."""
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    def generate(self, contents, timeout: float | None = None, model=None,
+                 profile: str | None = None, **kwargs):
+        """
+        Blocking generate_content with deadline, slot limit and retries.
+        <model> overrides the default (e.g. a cached-content model);
+        <profile> picks a GENERATION_PROFILES entry.
+        Identical text prompts already in flight share that call's response.
+        """
+        model = model or self.model
+        if profile is not None:
+            kwargs["generation_config"] = profile_config(profile, kwargs.get("generation_config"))
+        if isinstance(contents, str):
+            key = Coalescer.key(model.model_name, getattr(model, "cached_content", None), contents, kwargs)
+            return coalesce["generate"].run(
+                key, lambda: self._generate(contents, timeout, model, profile, **kwargs),
+                timeout=timeout or self.timeout)
+        return self._generate(contents, timeout, model, profile, **kwargs)
+
+    def _generate(self, contents, timeout, model, profile, **kwargs):
+        started  = time.monotonic()
+        deadline = started + (timeout or self.timeout)
+        self._count("calls")
+        priority = current_priority()
+        if not self._gate.acquire(priority, timeout=max(0.0, deadline - time.monotonic())):
+            self._count("timeouts")
+            raise TimeoutError("no free LLM slot before deadline")
+        try:
+            last = None
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rate_limit("generate", remaining)
+                    response = model.generate_content(
+                        contents, request_options={"timeout": max(0.1, deadline - time.monotonic())}, **kwargs)
+                    self._record(profile, started, getattr(response, "usage_metadata", None))
+                    return response
+                except _RETRYABLE as e:
+                    last = e
+                    print(f"⚠️  LLM attempt {attempt + 1} failed:", e)
+                    delay = self.backoff(attempt)
+                    if attempt == self.retries or time.monotonic() + delay >= deadline:
+                        break
+                    self._count("retries")
+                    time.sleep(delay)
+            self._give_up(last, "LLM call")
+        except TimeoutError:
+            raise
+        except _RETRYABLE:
+            raise                                  # already counted by _give_up
+        except Exception:
+            self._count("failures")
+            raise
+        finally:
+            self._gate.release(priority)
+
+    def stream(self, contents, timeout: float | None = None, model=None,
+               profile: str | None = None, **kwargs):
+        """
+        Yield text deltas from a streamed generate_content.
+        Retries only happen before the first delta reaches the caller.
+        """
+        if profile is not None:
+            kwargs["generation_config"] = profile_config(profile, kwargs.get("generation_config"))
+        started  = time.monotonic()
+        deadline = started + (timeout or self.timeout)
+        self._count("calls")
+        priority = current_priority()
+        if not self._gate.acquire(priority, timeout=max(0.0, deadline - time.monotonic())):
+            self._count("timeouts")
+            raise TimeoutError("no free LLM slot before deadline")
+        try:
+            last = None
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                streaming = False
+                try:
+                    rate_limit("generate", remaining)
+                    chunks = (model or self.model).generate_content(
+                        contents, stream=True,
+                        request_options={"timeout": max(0.1, deadline - time.monotonic())}, **kwargs)
+                    usage = None
+                    for chunk in chunks:
+                        usage = getattr(chunk, "usage_metadata", None) or usage
+                        try:
+                            text = chunk.text
+                        except ValueError:          # chunk without text parts
+                            continue
+                        if text:
+                            streaming = True
+                            yield text
+                    self._record(profile, started, usage)
+                    return
+                except _RETRYABLE as e:
+                    if streaming:
+                        self._count("failures")
+                        raise
+                    last = e
+                    print(f"⚠️  LLM stream attempt {attempt + 1} failed:", e)
+                    delay = self.backoff(attempt)
+                    if attempt == self.retries or time.monotonic() + delay >= deadline:
+                        break
+                    self._count("retries")
+                    time.sleep(delay)
+            self._give_up(last, "LLM stream")
+        except TimeoutError:
+            raise
+        except _RETRYABLE:
+            raise                                  # counted by _give_up / above
+        except Exception:
+            self._count("failures")
+            raise
+        finally:
+            self._gate.release(priority)
+
+    async def agenerate(self, contents, timeout: float | None = None, model=None, **kwargs):
+        """Awaitable generate(); shares the same slots and deadline rules."""
+        return await asyncio.to_thread(self.generate, contents, timeout, model, **kwargs)
+
+llm = LLMClient(gemini_model, LLM_CONCURRENCY, LLM_TIMEOUT, LLM_RETRIES)
+
+# ── Embeddings ─────────────────────────────────────────────────────────
+EMBED_MODEL       = "models/embedding-001"
+# Backend chain, first one that initialises wins, e.g. EMBED_BACKEND=local,remote
+EMBED_BACKENDS    = [b.strip() for b in os.getenv("EMBED_BACKEND", "remote").split(",") if b.strip()]
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "all-MiniLM-L6-v2")
+_embed_lock  = threading.Lock()
+embed_stats  = {"hits": 0, "misses": 0}   # utterance vectors reused / computed
+
+class RemoteEmbedder:
+    """Gemini embedding API (one network round trip per batch)."""
+    batch_size = 100                             # Gemini batch-embed limit
+
+    def __init__(self, model: str = EMBED_MODEL):
+        self.name = model
+
+    def embed(self, texts: list[str], task_type: str) -> list[list[float]]:
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            out.extend(coalesce["embed"].run(
+                Coalescer.key(self.name, task_type, batch),
+                lambda: self._embed_batch(batch, task_type)))
+        return out
+
+    def _embed_batch(self, batch: list[str], task_type: str) -> list[list[float]]:
+        rate_limit("embed")
+        response = genai.embed_content(
+            model=self.name,
+            content=batch,
+            task_type=task_type
+        )
+        return response["embedding"]
+
+class LocalEmbedder:
+    """
+    In-process sentence-transformers model on CPU.
+    Batched, serialised by a lock, no network; task_type is ignored.
+    """
+    batch_size = 32
+
+    def __init__(self, model_name: str = LOCAL_EMBED_MODEL):
+        from sentence_transformers import SentenceTransformer   # optional dependency
+        self.name   = f"sentence-transformers/{model_name}"
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self._lock  = threading.Lock()
+
+    def embed(self, texts: list[str], task_type: str) -> list[list[float]]:
+        with self._lock:
+            vecs = self._model.encode(texts,
+                                      batch_size=self.batch_size,
+                                      convert_to_numpy=True,
+                                      normalize_embeddings=True,
+                                      show_progress_bar=False)
+        return vecs.tolist()
+
+_EMBEDDERS      = {"remote": RemoteEmbedder, "local": LocalEmbedder}
+_embedder       = None
+_embedder_lock  = threading.Lock()
+
+def active_embedder():
+    """
+    Resolve EMBED_BACKEND once, falling back along the chain and finally
+    to the remote model. Fixed for the process lifetime so interest and
+    utterance vectors always live in the same space.
+    """
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            for name in EMBED_BACKENDS + ["remote"]:
+                try:
+                    _embedder = _EMBEDDERS[name]()
+                    break
+                except Exception as e:
+                    print(f"⚠️  Embedding backend '{name}' unavailable:", e)
+            print(f"🔎  Embedding backend: {_embedder.name}")
+        return _embedder
+
+def embed_text(text: str) -> list[float]:
+    """One SEMANTIC_SIMILARITY embedding for <text> from the active backend."""
+    return active_embedder().embed([text], "SEMANTIC_SIMILARITY")[0]
+
+def _count_embed(hit: bool):
+    with _embed_lock:
+        embed_stats["hits" if hit else "misses"] += 1
+
+class EmbeddingStore:
+    """
+    Content-addressed vectors on disk (SQLite blob table).
+    Key = sha256(model | task_type | text), value = float32 bytes,
+    so a text is only ever embedded once per model/task.
+    """
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vecs (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+        self._db.commit()
+        self.stats = {"hits": 0, "misses": 0, "batches": 0}
+
+    @staticmethod
+    def key(model: str, task_type: str, text: str) -> str:
+        return hashlib.sha256(f"{model}|{task_type}|{text}".encode()).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):          # SQLite variable limit
+                part = keys[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vec FROM vecs WHERE key IN ({','.join('?' * len(part))})",
+                    part).fetchall()
+                found.update((k, np.frombuffer(v, dtype=np.float32).tolist()) for k, v in rows)
+        return found
+
+    def put_many(self, items: dict[str, list[float]]):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO vecs (key, vec) VALUES (?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items.items()])
+            self._db.commit()
+
+embed_store = EmbeddingStore(EMBED_DB)
+
+def embed_many(texts: list[str], task_type: str = "SEMANTIC_SIMILARITY") -> list[list[float]]:
+    """
+    Vectors for <texts>, in order.
+    Store hits cost nothing; all misses go to the backend in one batch.
+    """
+    embedder = active_embedder()
+    keys     = [EmbeddingStore.key(embedder.name, task_type, t) for t in texts]
+    found    = embed_store.get_many(list(dict.fromkeys(keys)))
+    missing  = list(dict.fromkeys(t for t, k in zip(texts, keys) if k not in found))
+
+    fresh = {}
+    if missing:
+        vecs  = embedder.embed(missing, task_type)
+        fresh = {EmbeddingStore.key(embedder.name, task_type, t): v
+                 for t, v in zip(missing, vecs)}
+        embed_store.stats["batches"] += 1
+    if fresh:
+        embed_store.put_many(fresh)
+        found.update(fresh)
+
+    embed_store.stats["hits"]   += len(texts) - len(missing)
+    embed_store.stats["misses"] += len(missing)
+    return [found[k] for k in keys]
+
+# ── Roster size / speaker index ───────────────────────────────────────
+ROSTER_SIZE    = int(os.getenv("ROSTER_SIZE", 5))        # NPCs per /topic
+MAX_ROSTER     = int(os.getenv("MAX_ROSTER", 100))       # largest num_npcs /topic accepts
+ANN_MIN_ROSTER = int(os.getenv("ANN_MIN_ROSTER", 50))    # use faiss from this many NPCs
+ANN_TOP_K      = int(os.getenv("ANN_TOP_K", 8))          # candidates scored in full
+
 # Track used names to avoid duplicates
 used_names = set()
 
@@ -104,6 +737,11 @@ used_names = set()
 audio = pyaudio.PyAudio()
 
 
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", 6))     # in-flight synthesize_speech calls
+tts_gate = PriorityGate(TTS_CONCURRENCY, {Priority.IDLE:     max(1, TTS_CONCURRENCY // 2),
+                                          Priority.FEEDBACK: 1,
+                                          Priority.ROSTER:   max(1, TTS_CONCURRENCY // 2)})
+
 def tts_for(npc, line: str) -> str:
     """
     Synthesize <line> with <npc>'s assigned voice.
@@ -114,7 +752,12 @@ def tts_for(npc, line: str) -> str:
     mp3 = AUDIO_DIR / f"{h}.mp3"
     if mp3.exists():
         return f"/static/audio/{mp3.name}"
+    # same voice+line already being synthesized elsewhere → wait for that one
+    return coalesce["tts"].run(h, lambda: _synthesize(npc, line, mp3))
 
+def _synthesize(npc, line: str, mp3: pathlib.Path) -> str:
+    if mp3.exists():
+        return f"/static/audio/{mp3.name}"
     synthesis_input = texttospeech.SynthesisInput(text=line)
     voice_params    = texttospeech.VoiceSelectionParams(
         language_code="en-US",
@@ -123,12 +766,97 @@ def tts_for(npc, line: str) -> str:
     audio_cfg       = texttospeech.AudioConfig(
         audio_encoding=texttospeech.AudioEncoding.MP3
     )
-    resp = tts_client.synthesize_speech(
-        input=synthesis_input, voice=voice_params, audio_config=audio_cfg
-    )
-    mp3.write_bytes(resp.audio_content)
+    rate_limit("tts")
+    with tts_gate.slot():                  # priority-ordered, capped per class
+        resp = tts_client.synthesize_speech(
+            input=synthesis_input, voice=voice_params, audio_config=audio_cfg
+        )
+    # write next to the target, then rename: readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=mp3.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(resp.audio_content)
+        os.replace(tmp, mp3)
+    except BaseException:
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
     return f"/static/audio/{mp3.name}"
 
+# ── Sentence-chunked TTS ───────────────────────────────────────────────
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", 4))
+tts_pool    = ThreadPoolExecutor(max_workers=TTS_WORKERS)
+
+class SentenceSplitter:
+    """
+    Incrementally cut streamed text into speakable sentences.
+    Fragments shorter than <min_chars> ride along with the next sentence
+    so the audio isn't chopped into tiny clips.
+    """
+    _END = re.compile(r'[.!?…]+["\'”’)\]]*\s+|\n+')
+
+    def __init__(self, min_chars: int = 24):
+        self.min_chars = min_chars
+        self._buf      = ""
+
+    def feed(self, text: str) -> list[str]:
+        self._buf += text
+        out, start = [], 0
+        for m in self._END.finditer(self._buf):
+            cand = self._buf[start:m.end()].strip()
+            if len(cand) >= self.min_chars:
+                out.append(cand)
+                start = m.end()
+        self._buf = self._buf[start:]
+        return out
+
+    def flush(self) -> list[str]:
+        rest, self._buf = self._buf.strip(), ""
+        return [rest] if rest else []
+
+class TTSPipeline:
+    """
+    Ordered sentence-level TTS for one NPC.
+    add() submits a chunk to tts_pool right away (cached via tts_for);
+    ready()/drain() hand back (index, url) strictly in sentence order.
+    """
+    def __init__(self, npc):
+        self.npc   = npc
+        self.urls  = []
+        self._futs = []
+        self._next = 0
+
+    def add(self, sentence: str):
+        self._futs.append(tts_pool.submit(with_priority(Priority.REPLY_TTS, tts_for),
+                                          self.npc, sentence))
+
+    def _take(self):
+        i, self._next = self._next, self._next + 1
+        try:
+            url = self._futs[i].result()
+        except Exception as e:
+            print("⚠️  TTS chunk failed:", e)
+            return None
+        self.urls.append(url)
+        return i, url
+
+    def ready(self) -> list[tuple[int, str]]:
+        """Chunks finished so far (in order), without blocking."""
+        out = []
+        while self._next < len(self._futs) and self._futs[self._next].done():
+            item = self._take()
+            if item:
+                out.append(item)
+        return out
+
+    def drain(self) -> list[tuple[int, str]]:
+        """Wait for every remaining chunk."""
+        out = []
+        while self._next < len(self._futs):
+            item = self._take()
+            if item:
+                out.append(item)
+        return out
+
 
 def _rms(frame: bytes) -> float:
     """Return root-mean-square of a **bytes** frame (16-bit mono)."""
@@ -142,15 +870,12 @@ def stt_bytes(wav_bytes: bytes) -> str:
                 encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
                 sample_rate_hertz=RATE,
                 language_code="en-US")
+    rate_limit("stt")
     resp  = stt_client.recognize(config=cfg, audio=audio)
     print("STT response:", resp.results[0].alternatives[0].transcript)
     return resp.results[0].alternatives[0].transcript if resp.results else ""
 
 
-def last_turns(n=10):
-    """Return last n turns formatted `Speaker: text`."""
-    return "\n".join(f"{t['speaker']}: {t['text']}" for t in conversation[-n:])
-
 def voice_loop():
     """
     Background thread:
@@ -214,29 +939,254 @@ def voice_loop():
 
 # NPC Generation Functions
 
+class RosterStore:
+    """
+    Rosters for many topics in one SQLite file: personality data, voice,
+    interest vectors and any pre-warmed opener per NPC, so a known topic comes back without any
+    LLM, embedding or voice work. Each put is one transaction. Rosters
+    older than <max_age> seconds are dropped, and beyond <max_topics> the
+    least recently used topic goes first.
+    match() also finds rosters built for a differently worded topic:
+    same normalized form, or topic embeddings at least <threshold>
+    cosine-similar.
+    Rows remember which embedder (and dimension) produced their vectors;
+    a row from another embedder is treated as a miss.
+    """
+    def __init__(self, path: Path, max_topics: int, max_age: float, threshold: float):
+        self.max_topics, self.max_age, self.threshold = max_topics, max_age, threshold
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rosters ("
+            " topic TEXT PRIMARY KEY, npcs TEXT NOT NULL, vecs BLOB NOT NULL,"
+            " dim INTEGER NOT NULL, created REAL NOT NULL, used REAL NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS topic_requests ("
+            " norm TEXT PRIMARY KEY, topic TEXT NOT NULL, hits INTEGER NOT NULL, last REAL NOT NULL)")
+        cols = {c[1] for c in self._db.execute("PRAGMA table_info(rosters)")}
+        if "norm" not in cols:                     # stores created before topic matching
+            self._db.execute("ALTER TABLE rosters ADD COLUMN norm TEXT")
+            self._db.execute("ALTER TABLE rosters ADD COLUMN topic_vec BLOB")
+        if "embedder" not in cols:                 # stores created before embedder tracking
+            self._db.execute("ALTER TABLE rosters ADD COLUMN embedder TEXT")
+        self._db.commit()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0,
+                      "exact": 0, "normalized": 0, "semantic": 0}
+
+    def match(self, topic: str) -> str | None:
+        """Stored topic whose roster can serve <topic>, or None."""
+        norm = normalize_topic(topic)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT topic, norm, topic_vec, dim FROM rosters WHERE created >= ? AND embedder = ?",
+                (time.time() - self.max_age, active_embedder().name)).fetchall()
+        if not rows:
+            return None
+        for stored, stored_norm, _, _ in rows:
+            if stored == topic:
+                self.stats["exact"] += 1
+                return stored
+        for stored, stored_norm, _, _ in rows:
+            if stored_norm == norm:
+                self.stats["normalized"] += 1
+                return stored
+        q = topic_vec(topic)
+        if q is None:
+            return None
+        with_vecs = [(t, v) for t, _, v, dim in rows
+                     if v and len(v) == 4 * len(q) and dim in (0, len(q))]
+        if not with_vecs:
+            return None
+        m    = _unit_rows(np.stack([np.frombuffer(v, dtype=np.float32) for _, v in with_vecs]))
+        sims = m @ _unit_rows(np.asarray([q], dtype=np.float32))[0]
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        self.stats["semantic"] += 1
+        print(f"♻️  Topic “{topic}” ≈ “{with_vecs[best][0]}” ({sims[best]:.2f}), reusing its roster.")
+        return with_vecs[best][0]
+
+    def get(self, topic: str) -> list[NPC] | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT npcs, vecs, dim, created, embedder FROM rosters WHERE topic = ?",
+                (topic,)).fetchone()
+            if (row is None or time.time() - row[3] > self.max_age
+                    or row[4] != active_embedder().name):
+                self.stats["misses"] += 1
+                return None
+            with self._db:
+                self._db.execute("UPDATE rosters SET used = ? WHERE topic = ?", (time.time(), topic))
+        entries, dim = json.loads(row[0]), row[2]
+        flat = np.frombuffer(row[1], dtype=np.float32).reshape(-1, dim) if dim else None
+        npcs, at = [], 0
+        for e in entries:
+            n    = e["interests"]
+            vecs = flat[at:at + n].tolist() if flat is not None else None
+            at  += n
+            npcs.append(NPC(e["name"], e["personality_data"], vecs, e.get("voice"),
+                            opener=e.get("opener")))
+        self.stats["hits"] += 1
+        return npcs
+
+    def put(self, topic: str, npcs: list[NPC]):
+        vecs = [v for n in npcs for v in n.interest_vecs]
+        dim  = len(vecs[0]) if vecs else 0
+        entries = [{"name": n.name, "personality_data": n.personality_data,
+                    "voice": n.voice_name, "interests": len(n.interest_vecs),
+                    "opener": n.opener} for n in npcs]
+        q   = topic_vec(topic)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO rosters "
+                "(topic, npcs, vecs, dim, created, used, norm, topic_vec, embedder) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (topic, json.dumps(entries, ensure_ascii=False),
+                 np.asarray(vecs, dtype=np.float32).tobytes(), dim, now, now,
+                 normalize_topic(topic),
+                 np.asarray(q, dtype=np.float32).tobytes() if q is not None else None,
+                 active_embedder().name))
+            self.stats["stores"] += 1
+            self._evict(now)
+
+    def openers(self, topic: str) -> dict | None:
+        """name → pre-warmed opener (None where missing) for <topic>'s roster, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT npcs FROM rosters WHERE topic = ?", (topic,)).fetchone()
+        return {e["name"]: e.get("opener") for e in json.loads(row[0])} if row else None
+
+    def set_openers(self, topic: str, openers: dict):
+        """Add openers (name → text) to a stored roster without changing its age."""
+        with self._lock, self._db:
+            row = self._db.execute("SELECT npcs FROM rosters WHERE topic = ?", (topic,)).fetchone()
+            if row is None:
+                return
+            entries = json.loads(row[0])
+            for e in entries:
+                e["opener"] = openers.get(e["name"], e.get("opener"))
+            self._db.execute("UPDATE rosters SET npcs = ? WHERE topic = ?",
+                             (json.dumps(entries, ensure_ascii=False), topic))
+
+    def _evict(self, now: float):
+        cur = self._db.execute("DELETE FROM rosters WHERE created < ?", (now - self.max_age,))
+        evicted = cur.rowcount
+        cur = self._db.execute(
+            "DELETE FROM rosters WHERE topic NOT IN "
+            "(SELECT topic FROM rosters ORDER BY used DESC LIMIT ?)", (self.max_topics,))
+        self.stats["evicted"] += evicted + cur.rowcount
+
+    def record_request(self, topic: str):
+        """Count a /topic request (variants of one topic share a counter)."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO topic_requests (norm, topic, hits, last) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(norm) DO UPDATE SET hits = hits + 1, topic = excluded.topic, "
+                "last = excluded.last",
+                (normalize_topic(topic), topic, time.time()))
+
+    def popular(self, n: int, min_hits: int = 1) -> list[str]:
+        """The <n> most requested topics (latest wording of each)."""
+        with self._lock:
+            return [t for (t,) in self._db.execute(
+                "SELECT topic FROM topic_requests WHERE hits >= ? "
+                "ORDER BY hits DESC, last DESC LIMIT ?", (min_hits, n))]
+
+    def age(self, topic: str) -> float | None:
+        """Seconds since a roster for <topic> (or its normalized form) was built."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(created) FROM rosters WHERE (topic = ? OR norm = ?) AND embedder = ?",
+                (topic, normalize_topic(topic), active_embedder().name)).fetchone()
+        return time.time() - row[0] if row and row[0] is not None else None
+
+    def topics(self) -> list[str]:
+        with self._lock:
+            return [t for (t,) in self._db.execute("SELECT topic FROM rosters ORDER BY used DESC")]
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM rosters")
+
+ROSTER_STORE_TOPICS  = int(os.getenv("ROSTER_STORE_TOPICS", 50))
+ROSTER_STORE_MAX_AGE = float(os.getenv("ROSTER_STORE_MAX_AGE", 7 * 24 * 3600))  # seconds
+ROSTER_BG_REFRESH    = os.getenv("ROSTER_BG_REFRESH", "0") == "1"  # rebuild cached rosters in background
+TOPIC_MATCH_THRESHOLD = float(os.getenv("TOPIC_MATCH_THRESHOLD", 0.9))  # cosine sim to reuse a roster
+_TOPIC_STOPWORDS = {"a", "an", "the", "for", "of", "to", "in", "on", "at", "about",
+                    "my", "your", "with", "and", "or", "how", "talking", "practice", "practise"}
+
+def normalize_topic(topic: str) -> str:
+    """
+    Canonical form for topic lookups: lower-case words without
+    punctuation, filler words or plural -s, sorted — so "Job interviews"
+    and "interview for a job" both become "interview job".
+    """
+    words = re.findall(r"[a-z0-9']+", topic.lower())
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+             for w in words if w not in _TOPIC_STOPWORDS]
+    return " ".join(sorted(set(words))) or topic.strip().lower()
+
+def topic_vec(topic: str):
+    """Embedding of a topic for roster matching (None on error)."""
+    try:
+        return embed_many([topic.strip().lower()])[0]
+    except Exception as e:
+        print("⚠️ topic embedding failed:", e)
+        return None
+
+roster_store = RosterStore(ROSTER_DB, ROSTER_STORE_TOPICS, ROSTER_STORE_MAX_AGE, TOPIC_MATCH_THRESHOLD)
+
 def _save_npc_cache(npcs, topic):
-    """Dump current NPC personalities so next run can reload instantly."""
-    CACHE_FILE.write_text(
-        json.dumps(
-            {"topic": topic,
-             "npcs": [npc.personality_data for npc in npcs]},
-            ensure_ascii=False, indent=2)
-    )
+    """Keep this topic's roster so the next /topic for it is instant."""
+    try:
+        roster_store.put(topic, npcs)
+    except sqlite3.Error as e:
+        print("⚠️  Couldn’t store NPC roster:", e)
+
+def _prefetch_interest_vecs(pdatas):
+    """Embed every roster interest in one batch so NPC() only hits the store."""
+    embed_many([i for pd in pdatas for i in NPC.extract_interests(pd)])
 
 def _load_npc_cache(topic):
-    """Return list[NPC] or None if cache missing / wrong topic / corrupt."""
-    if not CACHE_FILE.exists():
-        return None
+    """Return list[NPC] or None if no fresh roster is stored for <topic> (or one like it)."""
     try:
-        blob = json.loads(CACHE_FILE.read_text(encoding="utf-8"))
-        if blob.get("topic") != topic:
+        stored = roster_store.match(topic)
+        if stored is None:
+            roster_store.stats["misses"] += 1
             return None
-        cached = [NPC(pd["name"], pd) for pd in blob["npcs"]]
-        print(f"⚡  Loaded {len(cached)} NPCs from cache.")
-        return cached
+        cached = roster_store.get(stored)
     except Exception as e:
-        print("⚠️  Couldn’t read NPC cache:", e)
+        print("⚠️  Couldn’t read NPC roster:", e)
         return None
+    if cached:
+        print(f"⚡  Loaded {len(cached)} NPCs from cache.")
+    return cached
+
+def _import_legacy_cache():
+    """One-time move of the old single-topic npc_cache.json into roster_store."""
+    if not CACHE_FILE.exists():
+        return
+    try:
+        blob = json.loads(CACHE_FILE.read_text(encoding="utf-8"))
+        if blob.get("topic") and blob["topic"] not in roster_store.topics():
+            _prefetch_interest_vecs(blob["npcs"])
+            _save_npc_cache([NPC(pd["name"], pd) for pd in blob["npcs"]], blob["topic"])
+        CACHE_FILE.rename(CACHE_FILE.with_suffix(".json.imported"))
+    except Exception as e:
+        print("⚠️  Couldn’t import legacy NPC cache:", e)
+
+def refresh_roster(num_npcs: int, topic: str):
+    """
+    Background job: rebuild <topic>'s stored roster for next time – with
+    openers again if the roster it replaces was pre-warmed.
+    """
+    stored  = roster_store.match(topic)
+    openers = roster_store.openers(stored) if stored else None
+    if openers and any(openers.values()):
+        prewarm_roster(topic, num_npcs)
+        return
+    with private_voice_pool():
+        generate_diverse_npcs(num_npcs, topic, force=True)
 
 def generate_human_name(topic: str, attempt: int = 0) -> str:
     global used_names
@@ -252,14 +1202,10 @@ def generate_human_name(topic: str, attempt: int = 0) -> str:
     Return ONLY THE NAME (first) and nothing else. No explanation, no quotes, no punctuation.
     """
     try:
-        response = gemini_model.generate_content(
+        response = llm.generate(
             name_prompt,
-            generation_config={
-                "temperature": 0.95 + (attempt * 0.05),
-                "max_output_tokens": 50,
-                "top_k": 40,
-                "top_p": 0.98,
-            }
+            profile="name",
+            generation_config={"temperature": 0.95 + (attempt * 0.05)},
         )
         name = response.text.strip()
         name_parts = name.split()
@@ -271,6 +1217,93 @@ def generate_human_name(topic: str, attempt: int = 0) -> str:
         common_names = ["Alex", "Maria", "David", "Aisha", "James"]
         return common_names[attempt % len(common_names)]
 
+PERSONA_FIELDS = ["traits", "backstory", "interests_hobbies", "attitude",
+                  "tone", "appearance", "introversion", "assertiveness"]
+PERSONA_JSON_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {f: {"type": "string"} for f in PERSONA_FIELDS},
+        "required": PERSONA_FIELDS,
+    },
+}
+persona_stats = {"schema": 0, "extracted": 0, "retries": 0, "defaults": 0}
+
+DIVERSITY_DIRECTIONS = [
+    "extremely introverted and analytical", "highly extroverted and spontaneous",
+    "eccentric and unconventional", "traditional and disciplined"
+]
+CULTURAL_BACKGROUNDS = ["East Asian", "South Asian", "Middle Eastern", "Latin American"]
+AGE_RANGES = ["young adult (20-29)", "early thirties", "fifties", "seventies"]
+
+class JSONObjectStream:
+    """
+    Pulls complete top-level JSON objects out of text that arrives in
+    chunks: anything between objects (fences, prose, array brackets,
+    commas) is skipped, braces inside strings are ignored, and malformed
+    objects are dropped. flush() tries to close an object cut off by the
+    output limit.
+    """
+    def __init__(self):
+        self._buf, self._depth, self._in_str, self._esc = [], 0, False, False
+
+    def feed(self, chunk: str) -> list[dict]:
+        out = []
+        for ch in chunk:
+            if self._depth == 0:
+                if ch == "{":
+                    self._buf, self._depth, self._in_str, self._esc = ["{"], 1, False, False
+                continue
+            self._buf.append(ch)
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        out.append(json.loads("".join(self._buf)))
+                    except json.JSONDecodeError:
+                        pass
+        return out
+
+    def flush(self) -> dict | None:
+        if self._depth == 0:
+            return None
+        tail = ('"' if self._in_str else "") + "}" * self._depth
+        self._depth = 0
+        try:
+            return json.loads("".join(self._buf).rstrip().rstrip(",") + tail)
+        except json.JSONDecodeError:
+            return None
+
+def extract_json(text: str) -> dict | None:
+    """First JSON object in <text>, tolerating fences, prose and truncation."""
+    stream = JSONObjectStream()
+    found  = stream.feed(text)
+    return found[0] if found else stream.flush()
+
+def parse_persona(raw: str) -> dict | None:
+    """Persona dict from a schema-mode reply, or None if fields are missing."""
+    try:
+        personality = json.loads(raw)
+        kind = "schema"
+    except json.JSONDecodeError:
+        personality = extract_json(raw)
+        kind = "extracted"
+    if not isinstance(personality, dict) or not all(f in personality for f in PERSONA_FIELDS):
+        return None
+    persona_stats[kind] += 1
+    return personality
+
 def generate_diverse_personality(name: str, topic: str, attempt: int = 0, 
                                  previous_personalities: list = None) -> dict:
     if previous_personalities is None:
@@ -281,12 +1314,9 @@ def generate_diverse_personality(name: str, topic: str, attempt: int = 0,
     avoid_traits_str = ", ".join(avoid_traits[:10])
     avoid_tones_str = ", ".join(avoid_tones[:10])
     avoid_demographics_str = ", ".join(avoid_demographics[:10])
-    diversity_directions = [
-        "extremely introverted and analytical", "highly extroverted and spontaneous",
-        "eccentric and unconventional", "traditional and disciplined"
-    ]
-    cultural_backgrounds = ["East Asian", "South Asian", "Middle Eastern", "Latin American"]
-    age_ranges = ["young adult (20-29)", "early thirties", "fifties", "seventies"]
+    diversity_directions = DIVERSITY_DIRECTIONS
+    cultural_backgrounds = CULTURAL_BACKGROUNDS
+    age_ranges = AGE_RANGES
     direction_index = (len(previous_personalities) + attempt) % len(diversity_directions)
     culture_index = (len(previous_personalities) + attempt + 3) % len(cultural_backgrounds)
     age_index = (len(previous_personalities) + attempt + 5) % len(age_ranges)
@@ -311,21 +1341,19 @@ def generate_diverse_personality(name: str, topic: str, attempt: int = 0,
     """
     max_attempts = 3
     for retry in range(max_attempts):
+        if retry:
+            persona_stats["retries"] += 1
         try:
-            response = gemini_model.generate_content(personality_prompt)
-            json_str = response.text.strip()
-            if json_str.startswith('```json') and json_str.endswith('```'):
-                json_str = '\n'.join(json_str.split('\n')[1:-1])
-            personality = json.loads(json_str)
-            required_fields = ["traits", "backstory", "interests_hobbies", "attitude", 
-                               "tone", "appearance", "introversion", "assertiveness"]
-            if all(field in personality for field in required_fields):
+            response = llm.generate(personality_prompt, profile="personality",
+                                    generation_config=PERSONA_JSON_CONFIG)
+            personality = parse_persona(response.text)
+            if personality is not None:
                 personality["name"] = name
                 personality["topic"] = topic
                 return personality
         except Exception as e:
             print(f"Error on attempt {retry+1}: {e}")
-        time.sleep(1)
+    persona_stats["defaults"] += 1
     return {
         "name": name,
         "traits": "thoughtful, unique",
@@ -340,131 +1368,433 @@ def generate_diverse_personality(name: str, topic: str, attempt: int = 0,
     }
 
 _name_lock   = threading.Lock()
-_used_names  = set()
+_used_names  = set()          # lower-cased, so claims are O(1) and case-insensitive
+_name_local  = threading.local()
+
+def _names_in_use() -> set:
+    """The roster being built on this thread (see name_scope), else process-wide."""
+    scoped = getattr(_name_local, "used", None)
+    return scoped if scoped is not None else _used_names
+
+@contextmanager
+def name_scope():
+    """Names only have to be unique within one roster: give it a fresh set."""
+    outer, _name_local.used = getattr(_name_local, "used", None), set()
+    try:
+        yield
+    finally:
+        _name_local.used = outer
 
-def unique_human_name(topic: str, attempt_of: int) -> str:
+def name_taken(name: str) -> bool:
+    with _name_lock:
+        return name.lower() in _names_in_use()
+
+def claim_name(name: str) -> bool:
+    """Reserve <name> for this roster; False if it (or a case variant) is taken."""
+    key = name.lower()
+    with _name_lock:
+        used = _names_in_use()
+        if key in used:
+            return False
+        used.add(key)
+        return True
+
+NAME_SOURCE = os.getenv("NAME_SOURCE", "local")   # "local" (names.json) | "llm"
+
+class NameCorpus:
     """
-    Call generate_human_name() until we get a name we haven’t used yet.
-    Uses a thread-safe set so workers never clash.
+    Bundled first names indexed by region and gender, plus surnames for
+    when a region's first names run out. Also answers "which gender is
+    this first name" for voice assignment.
     """
+    def __init__(self, path: Path):
+        try:
+            self.regions = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print("⚠️  name corpus unavailable:", e)
+            self.regions = {}
+        self.gender_of = {}                  # lower-cased first name → gender
+        for region in self.regions.values():
+            for g in ("female", "male"):
+                for n in region.get(g, []):
+                    self.gender_of.setdefault(n.lower(), g)
+
+    def gender(self, first_name: str) -> str | None:
+        return self.gender_of.get(first_name.lower())
+
+    def draw(self, region: str | None = None, gender: str | None = None) -> tuple[str, str]:
+        """A name not yet claimed in this roster → (name, gender)."""
+        if region not in self.regions:
+            region = random.choice(list(self.regions))
+        gender = gender or random.choice(("female", "male"))
+        firsts = self.regions[region][gender]
+        free   = [n for n in firsts if not name_taken(n)]
+        random.shuffle(free)
+        for name in free:
+            if claim_name(name):
+                return name, gender
+        # first names used up → first + surname, then a numeric suffix
+        surnames = self.regions[region].get("surnames") or [region]
+        for _ in range(len(firsts) * len(surnames)):
+            name = f"{random.choice(firsts)} {random.choice(surnames)}"
+            if claim_name(name):
+                return name, gender
+        with _name_lock:
+            name = f"{random.choice(firsts)} {len(_names_in_use()) + 1:02d}"
+        claim_name(name)
+        return name, gender
+
+name_corpus = NameCorpus(NAMES_FILE)
+
+def slot_culture(idx: int) -> str:
+    """Cultural background the roster prompts use for slot <idx>."""
+    return CULTURAL_BACKGROUNDS[(idx + 3) % len(CULTURAL_BACKGROUNDS)]
+
+def unique_human_name(topic: str, attempt_of: int, region: str | None = None) -> str:
+    """
+    A name we haven’t used yet: drawn from the local corpus (no network),
+    or with NAME_SOURCE=llm by calling generate_human_name() until one
+    is free. Uses a thread-safe set so workers never clash.
+    """
+    if NAME_SOURCE == "local" and name_corpus.regions:
+        return name_corpus.draw(region)[0]
     MAX_TRIES = 10
     for _ in range(MAX_TRIES):
         cand = generate_human_name(topic, attempt_of)
-        with _name_lock:
-            if cand not in _used_names:
-                _used_names.add(cand)
-                return cand
+        if claim_name(cand):
+            return cand
     # Fallback: append a numeric suffix so *something* unique is returned
     with _name_lock:
-        suffix = len(_used_names) + 1
-        cand = f"{cand}_{suffix:02d}"
-        _used_names.add(cand)
-        return cand
+        suffix = len(_names_in_use()) + 1
+    cand = f"{cand}_{suffix:02d}"
+    claim_name(cand)
+    return cand
+
+# ── Batched roster generation ──────────────────────────────────────────
+BATCH_ROSTER        = os.getenv("BATCH_ROSTER", "1") == "1"   # many personas per call
+ROSTER_BATCH_ROUNDS = int(os.getenv("ROSTER_BATCH_ROUNDS", 2)) # calls before per-slot fallback
+ROSTER_PERSONA_TOKENS = int(os.getenv("ROSTER_PERSONA_TOKENS", 200))  # output budget per persona
+ROSTER_CHUNK = max(1, GENERATION_PROFILES["roster"]["max_output_tokens"] // ROSTER_PERSONA_TOKENS)
+ROSTER_JSON_CONFIG  = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {f: {"type": "string"} for f in ["name"] + PERSONA_FIELDS},
+            "required": ["name"] + PERSONA_FIELDS,
+        },
+    },
+}
+roster_stats = {"batch_calls": 0, "accepted": 0, "rejected": 0, "slot_fallbacks": 0}
+
+def build_roster_prompt(topic: str, slots: list[int], taken: list[dict],
+                        names: dict | None = None) -> str:
+    """
+    One prompt asking for a persona per slot, distinct from each other and
+    <taken>. With <names> (slot → name from the local corpus) the model
+    writes the persona for that person instead of inventing a name.
+    """
+    def who(i):
+        if not names:
+            return ""
+        g = name_corpus.gender(names[i].split()[0])
+        return f"{names[i]}{' (' + ('woman' if g == 'female' else 'man') + ')' if g else ''}; "
+
+    specs = "\n".join(
+        f"{k}. {who(i)}personality {DIVERSITY_DIRECTIONS[i % len(DIVERSITY_DIRECTIONS)]}; "
+        f"cultural background {slot_culture(i)}; "
+        f"age {AGE_RANGES[(i + 5) % len(AGE_RANGES)]}"
+        for k, i in enumerate(slots, start=1))
+    avoid = "; ".join(f"{p['name']} ({p['traits']}; tone {p['tone']})" for p in taken) or "None yet"
+    return f"""
+Generate a JSON array of exactly {len(slots)} personality profiles of different people who have experience with "{topic}", one per line below, in this order:
+{specs}
+
+Already in the group (do not reuse their names, traits or tones): {avoid}
+{"Use exactly the name given on each line." if names else "Names must be realistic first names a real person would have, culturally fitting, all different, with no fictional-sounding words."}
+Every profile must be clearly distinct from the others in traits, tone, attitude and appearance.
+Each object has these string fields:
+- "name": first name only
+- "traits": 4-5 comma-separated personality traits
+- "backstory": a specific personal experience related to {topic}
+- "interests_hobbies": 4-5 comma-separated hobbies or interests
+- "attitude": their outlook on life
+- "tone": their speaking style
+- "appearance": physical appearance, including age and cultural elements
+- "introversion": a number between 0.0 and 1.0
+- "assertiveness": a number between 0.0 and 1.0
+""".strip()
+
+def generate_roster_batch(num_npcs: int, topic: str, on_persona=None) -> list[dict]:
+    """
+    Persona dicts (with "name") for <num_npcs> slots in as few calls as
+    possible: ask for the open slots in chunks of ROSTER_CHUNK (what fits
+    the roster profile's output cap), all chunks at once, keep each
+    candidate whose fields are complete and whose name and traits aren't
+    already taken, and re-request only the rejected slots. Slots still
+    open after ROSTER_BATCH_ROUNDS fall back to the one-persona-at-a-time
+    path. With <on_persona>, the calls are streamed and on_persona(slot,
+    pdata) runs as soon as each persona is accepted.
+    Candidates are accepted on the calling thread, so name scope, voice
+    pool and cancellation all stay the roster job's.
+    """
+    pdatas = [None] * num_npcs
+    # local corpus → names are fixed up front and only personas are generated
+    names = ({i: unique_human_name(topic, i, slot_culture(i)) for i in range(num_npcs)}
+             if NAME_SOURCE == "local" and name_corpus.regions else None)
+
+    def accept(idx, cand, taken) -> bool:
+        ok = (persona_fields_ok(cand, ["name"] + PERSONA_FIELDS)
+              and cand["traits"].lower() not in {str(p["traits"]).lower() for p in taken})
+        if names is not None:
+            name = names[idx]
+        else:
+            name = " ".join(part.capitalize() for part in str(cand.get("name", "")).split())
+            ok = ok and claim_name(name)
+        if not ok:
+            roster_stats["rejected"] += 1
+            return False
+        cand["name"], cand["topic"] = name, topic
+        pdatas[idx] = cand
+        taken.append(cand)
+        roster_stats["accepted"] += 1
+        if on_persona is not None:
+            on_persona(idx, cand)
+        return True
+
+    def fetch(k, prompt, results, stop):
+        """One batched call; candidates go to <results> as (k, cand), then (k, None)."""
+        try:
+            stream = JSONObjectStream()
+            if on_persona is None:
+                chunks = [llm.generate(prompt, profile="roster",
+                                       generation_config=ROSTER_JSON_CONFIG).text]
+            else:
+                chunks = llm.stream(prompt, profile="roster", generation_config=ROSTER_JSON_CONFIG)
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                for cand in stream.feed(chunk):
+                    results.put((k, cand))
+        except Exception as e:
+            print("⚠️ batched roster call failed:", e)
+        finally:
+            results.put((k, None))
+
+    for _ in range(ROSTER_BATCH_ROUNDS):
+        check_roster_cancelled()
+        slots = [i for i, p in enumerate(pdatas) if p is None]
+        if not slots:
+            break
+        taken  = [p for p in pdatas if p is not None]
+        groups = [slots[j:j + ROSTER_CHUNK] for j in range(0, len(slots), ROSTER_CHUNK)]
+        results, stop = queue.Queue(), threading.Event()
+        open_slots = [iter(g) for g in groups]
+        roster_stats["batch_calls"] += len(groups)
+        with ThreadPoolExecutor(max_workers=min(8, len(groups))) as ex:
+            for k, group in enumerate(groups):
+                ex.submit(with_priority(Priority.ROSTER, fetch), k,
+                          build_roster_prompt(topic, group, taken, names), results, stop)
+            try:
+                running = len(groups)
+                while running:
+                    k, cand = results.get()
+                    check_roster_cancelled()
+                    if cand is None:
+                        running -= 1
+                        continue
+                    idx = next(open_slots[k], None)
+                    if idx is None:
+                        continue
+                    try:
+                        accept(idx, cand, taken)
+                    except RosterCancelled:
+                        raise
+                    except Exception as e:
+                        print("⚠️ roster candidate failed:", e)
+            except BaseException:
+                stop.set()                                  # let the other calls wind down
+                ex.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    missing = [i for i, p in enumerate(pdatas) if p is None]
+    if missing:
+        roster_stats["slot_fallbacks"] += len(missing)
+        fallback = {i: names[i] if names is not None else unique_human_name(topic, i, slot_culture(i))
+                    for i in missing}
+        build_personas(topic, fallback, [p for p in pdatas if p is not None], pdatas, on_persona)
+    return pdatas
+
+def persona_fields_ok(cand: dict, fields: list[str]) -> bool:
+    """Every field present as non-empty text (numbers allowed for the 0-1 scores)."""
+    return all(isinstance(cand.get(f), (str, int, float)) and not isinstance(cand.get(f), bool)
+               and str(cand[f]).strip() for f in fields) and isinstance(cand.get("traits"), str)
+
+def build_personas(topic: str, names: dict, previous: list, out: list, on_persona=None):
+    """
+    generate_diverse_personality() for every slot → name in <names>, in
+    parallel on the roster pool; results land in out[slot] and go to
+    on_persona(slot, pdata) as each finishes.
+    """
+    lock = threading.Lock()
+
+    def build_one(idx):
+        with lock:
+            prev = previous.copy()
+        pdata = generate_diverse_personality(names[idx], topic, idx, prev)
+        pdata["name"] = names[idx]
+        with lock:
+            previous.append(pdata)
+        return pdata
+
+    with ThreadPoolExecutor(max_workers=min(8, len(names))) as ex:
+        futures = {ex.submit(with_priority(Priority.ROSTER, build_one), i): i for i in names}
+        try:
+            for fut in as_completed(futures):
+                check_roster_cancelled()
+                idx = futures[fut]
+                out[idx] = fut.result()
+                if on_persona is not None:
+                    on_persona(idx, out[idx])
+        except BaseException:
+            ex.shutdown(wait=False, cancel_futures=True)    # don't build the rest
+            raise
 
 def generate_diverse_npcs(num_npcs: int,
                           topic: str,
-                          force: bool = False) -> list[NPC]:
+                          force: bool = False,
+                          on_npc=None) -> list[NPC]:
     """
-    1. Try to load from JSON cache ⇢ instant.
+    1. Try the stored roster for this topic ⇢ instant.
     2. Otherwise build in parallel, save to cache, return.
+    <on_npc>(npc) is called for every NPC as soon as it is ready, so a
+    caller can start using the first ones while the rest are built
+    (each then gets its own embedding call instead of one batch).
     """
     if not force:
         ready = _load_npc_cache(topic)
         if ready and len(ready) >= num_npcs:
+            if on_npc is not None:
+                for npc in ready[:num_npcs]:
+                    on_npc(npc)
             return ready[:num_npcs]
 
     print("🚧  Building fresh NPC roster …")
+    with name_scope():
+        return _build_roster(num_npcs, topic, on_npc)
 
-    # ── phase 1: unique names (sequential so we avoid duplicates) ──
-    names = [unique_human_name(topic, i) for i in range(num_npcs)]
+def _build_roster(num_npcs: int, topic: str, on_npc=None) -> list[NPC]:
+    """Fresh roster for <topic> (see generate_diverse_npcs), saved to cache."""
+    npcs = [None] * num_npcs
 
-    # shared list for personality diversity checks
-    previous_personalities = []
-    lock = threading.Lock()
+    def publish(idx, pdata):
+        _prefetch_interest_vecs([pdata])
+        npcs[idx] = NPC(pdata["name"], pdata)
+        on_npc(npcs[idx])
 
-    def build_one(idx):
-        nm = names[idx]
-        with lock:
-            prev = previous_personalities.copy()
-        pdata = generate_diverse_personality(nm, topic, idx, prev)
-        with lock:
-            previous_personalities.append(pdata)
-        return NPC(nm, pdata)
+    if BATCH_ROSTER:
+        pdatas = generate_roster_batch(num_npcs, topic, publish if on_npc is not None else None)
+        if on_npc is None:
+            _prefetch_interest_vecs(pdatas)
+            npcs = [NPC(p["name"], p) for p in pdatas]
+        return _finish_roster(npcs, topic)
 
-    # ── phase 2: personalities in parallel ────────────────
-    with ThreadPoolExecutor(max_workers=min(8, num_npcs)) as ex:
-        futures = {ex.submit(build_one, i): i for i in range(num_npcs)}
-        npcs = [None] * num_npcs
-        for fut in as_completed(futures):
-            idx = futures[fut]
-            npcs[idx] = fut.result()
+    # ── phase 1: unique names (sequential so we avoid duplicates) ──
+    names = [unique_human_name(topic, i, slot_culture(i)) for i in range(num_npcs)]
 
-    _save_npc_cache(npcs, topic)
-    return npcs
+    # ── phase 2: personalities in parallel ────────────────
+    check_roster_cancelled()
+    pdatas = [None] * num_npcs
+    build_personas(topic, dict(enumerate(names)), [], pdatas,
+                   publish if on_npc is not None else None)
+
+    # ── phase 3: one batched embedding request for the whole roster ──
+    if on_npc is None:
+        _prefetch_interest_vecs(pdatas)
+        npcs = [NPC(names[i], pdatas[i]) for i in range(num_npcs)]
+
+    return _finish_roster(npcs, topic)
+
+def _finish_roster(npcs: list, topic: str) -> list[NPC]:
+    """Store a complete roster; one with slots that never got published isn't kept."""
+    ready = [npc for npc in npcs if npc is not None]
+    if len(ready) == len(npcs):
+        _save_npc_cache(ready, topic)
+    else:
+        print(f"⚠️  Roster for “{topic}” incomplete ({len(ready)}/{len(npcs)}), not stored")
+    return ready
 
 # NPC Class
 class NPC:
-    def __init__(self, name, personality_data):
+    def __init__(self, name, personality_data, interest_vecs=None, voice_name=None, opener=None):
         self.name = name
         self.personality_data = personality_data
+        self.opener = opener          # pre-warmed first line (text + audio ready), if any
         self.personality = personality_data.get('traits', '')
         self.role = personality_data.get('topic', 'friend')
         self.introversion = float(personality_data.get('introversion', 0.5))
         self.assertiveness = float(personality_data.get('assertiveness', 0.5))
         self.original_interests = self._extract_interests_from_data()
         self.interests = self.original_interests
-        self.interest_vecs = self._encode_interests()
+        self.interest_vecs = interest_vecs if interest_vecs is not None else self._encode_interests()
         self.relationships = {}
         self.last_spoken = -1
         self.emotional_state = 5
                 # -------- gender + voice -----------------------------------
         self.gender      = self._infer_gender()
-        self.voice_name  = self._assign_voice()
+        self.voice_name  = self._claim_voice(voice_name) if voice_name else self._assign_voice()
 
 
         # --------------------------------------------------------------
     def _infer_gender(self) -> str:
         """Return 'male' | 'female' | 'unknown' (using first name)."""
         first = self.name.split()[0]
-        g = _gender_det.get_gender(first)
+        g = name_corpus.gender(first)
+        if g is None and _gender_det is not None:
+            g = _gender_det.get_gender(first)
         if g in ("female", "mostly_female"):
             return "female"
         if g in ("male", "mostly_male"):
             return "male"
         return "unknown"
 
+    @staticmethod
+    def _claim_voice(voice_name: str) -> str:
+        """Keep a stored voice and take it out of the free pools."""
+        for pool in _voices().values():
+            if voice_name in pool:
+                pool.remove(voice_name)
+        return voice_name
+
     def _assign_voice(self) -> str | None:
         """Pop a voice from the gender-matched pool; return its name."""
         pool_key = "female" if self.gender == "female" else "male"
-        pool = _voice_pool[pool_key]
+        pool = _voices()[pool_key]
         if not pool:                         # ran out, fall back to other pool
-            pool = _voice_pool["female" if pool_key == "male" else "male"]
+            pool = _voices()["female" if pool_key == "male" else "male"]
         return pool.pop(choice(range(len(pool)))) if pool else None
 
 
 
-    def _extract_interests_from_data(self):
+    @staticmethod
+    def extract_interests(personality_data: dict) -> list[str]:
         interests = []
-        if 'interests_hobbies' in self.personality_data:
-            interests_text = self.personality_data['interests_hobbies']
+        if 'interests_hobbies' in personality_data:
+            interests_text = personality_data['interests_hobbies']
             interests = [i.strip() for i in interests_text.split(',')]
         if not interests:
             interests = ["talking about life", "helping others", "sharing thoughts"]
         return interests[:9]
 
+    def _extract_interests_from_data(self):
+        return NPC.extract_interests(self.personality_data)
+
     def _encode_interests(self):
-        embeddings = []
-        for interest in self.interests:
-            response = genai.embed_content(
-                model="models/embedding-001",
-                content=interest,
-                task_type="SEMANTIC_SIMILARITY"
-            )
-            embeddings.append(response["embedding"])
-        return embeddings
-    def analyze_emotion(self, latest_user_input: str):
+        return embed_many(self.interests)
+    def estimate_emotion(self, latest_user_input: str) -> int | None:
         """
-        Update self.emotional_state (1-10).
+        New emotional_state (1-10) for <latest_user_input>, or None on failure.
         1 = delighted, 10 = devastated.
         """
         prompt = f"""
@@ -480,13 +1810,19 @@ class NPC:
     """.strip()
 
         try:
-            raw = gemini_model.generate_content(prompt).text
+            raw = llm.generate(prompt, profile="emotion").text
             json_blob = re.search(r"\{.*\}", raw).group()
             value = int(json.loads(json_blob)["value"])
-            self.emotional_state = max(1, min(10, value))
+            return max(1, min(10, value))
         except Exception as e:
             print("⚠️ emotion parse failed:", e)
-            # keep previous emotional_state
+            return None
+
+    def analyze_emotion(self, latest_user_input: str):
+        """Update self.emotional_state (1-10); keeps the old value on failure."""
+        value = self.estimate_emotion(latest_user_input)
+        if value is not None:
+            self.emotional_state = value
 
 
 
@@ -511,6 +1847,10 @@ You're not here to "fix" anyone. You're here — a real presence. You:
 # Generate NPCs
 topic       = None        # start with no topic
 npc_list    = []          # empty until /topic
+if RESET_CACHE:
+    roster_store.clear()
+else:
+    _import_legacy_cache()
 
 
 # Setup relationships
@@ -534,6 +1874,223 @@ max_npc_turns = 2
 idle_threshold = 7
 last_speaker = None
 
+def utterance_vec(entry: dict) -> list[float] | None:
+    """
+    Embedding for one `conversation` entry.
+    Computed on first use and stored on the entry as entry["vec"], so
+    relevancy scoring, relationship updates etc. all share a single call.
+    """
+    text = entry.get("text") or ""
+    if not text.strip():
+        return None
+    vec = entry.get("vec")
+    if vec is None:
+        vec = embed_text(text)
+        entry["vec"] = vec
+        _count_embed(hit=False)
+    return vec
+
+# ── Bounded history & rolling summary ──────────────────────────────────
+HISTORY_KEEP   = int(os.getenv("HISTORY_KEEP", 40))     # turns kept in memory after compaction
+HISTORY_MAX    = int(os.getenv("HISTORY_MAX", 60))      # compact once conversation grows past this
+SUMMARY_WORDS  = int(os.getenv("SUMMARY_WORDS", 120))   # length cap for the running summary
+TRANSCRIPT_FILE = Path(os.getenv("TRANSCRIPT_FILE", "transcript.jsonl"))
+# prompt kind → (max history lines, token budget for summary + history)
+HISTORY_BUDGETS = {
+    "reply"   : (6, 600),
+    "nudge"   : (10, 800),
+    "feedback": (10, 800),
+    "group"   : (10, 1000),
+}
+conversation_summary = ""    # running summary of turns no longer in `conversation`
+turns_spilled  = 0           # how many turns have left `conversation` this topic
+_unsummarized  = []          # spilled turns not yet folded into the summary
+_history_epoch = 0           # bumped by reset_history so stale summaries are discarded
+_history_lock  = threading.Lock()
+_summary_lock  = threading.Lock()   # one summarizer at a time
+SUMMARY_BACKLOG = int(os.getenv("SUMMARY_BACKLOG", 200))  # max turns waiting for a summary
+history_stats  = {"compactions": 0, "spilled": 0, "summaries": 0, "summary_failures": 0,
+                  "unsummarized_dropped": 0, "trimmed_lines": 0}
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token) for prompt budgeting."""
+    return len(text) // 4 + 1
+
+def history_block(history: list, kind: str) -> str:
+    """
+    Running summary + the most recent lines of <history> for a <kind>
+    prompt; the oldest lines are dropped first to fit the kind's budget.
+    """
+    max_lines, budget = HISTORY_BUDGETS[kind]
+    summary = (f"Earlier in the conversation: {conversation_summary}\n"
+               if conversation_summary and history else "")
+    budget -= approx_tokens(summary)
+    lines = []
+    for t in reversed(history[-max_lines:]):
+        line = f"{t['speaker']}: {t['text']}"
+        cost = approx_tokens(line)
+        if budget - cost < 0 and lines:
+            history_stats["trimmed_lines"] += 1
+            break
+        budget -= cost
+        lines.append(line)
+    return summary + "\n".join(reversed(lines))
+
+def _append_transcript(turns: list[dict]):
+    """Append spilled turns to the on-disk transcript (JSON lines)."""
+    with TRANSCRIPT_FILE.open("a", encoding="utf-8") as f:
+        for t in turns:
+            f.write(json.dumps({"topic": topic, "speaker": t["speaker"], "text": t["text"],
+                                "emotion": t.get("emotion")}, ensure_ascii=False) + "\n")
+
+def _summarize_worker(expected_topic: str):
+    """
+    Fold pending spilled turns into the running summary. Only one worker
+    runs at a time; it keeps going while new turns arrive and removes
+    exactly the turns it summarized.
+    """
+    global conversation_summary
+    if not _summary_lock.acquire(blocking=False):
+        return                          # the running worker picks these turns up
+    try:
+        while True:
+            with _history_lock:
+                if topic != expected_topic:
+                    return
+                pending, previous, epoch = list(_unsummarized), conversation_summary, _history_epoch
+            if not pending:
+                return
+            prompt = (
+                f"Update the running summary of a group conversation about \"{expected_topic}\".\n"
+                f"Current summary:\n{previous or '(none yet)'}\n\n"
+                "New lines (oldest first):\n"
+                + "\n".join(f"{t['speaker']}: {t['text']}" for t in pending) +
+                f"\n\nWrite the updated summary in under {SUMMARY_WORDS} words. Keep who said what "
+                "when it matters, open questions and how the user is doing. Plain text only."
+            )
+            try:
+                summary = llm.generate(prompt, profile="summary").text.strip()
+            except Exception as e:
+                print("⚠️ conversation summary failed:", e)
+                history_stats["summary_failures"] += 1
+                return
+            with _history_lock:
+                if epoch != _history_epoch:
+                    return
+                done = {id(t) for t in pending}
+                conversation_summary = summary
+                _unsummarized[:] = [t for t in _unsummarized if id(t) not in done]
+                history_stats["summaries"] += 1
+    finally:
+        _summary_lock.release()
+
+def compact_history():
+    """
+    Keep `conversation` bounded: once it passes HISTORY_MAX, the oldest
+    turns beyond HISTORY_KEEP go to the transcript file and are folded
+    into conversation_summary in the background.
+    """
+    global turns_spilled
+    with _history_lock:
+        if len(conversation) <= HISTORY_MAX:
+            return
+        spill = conversation[:len(conversation) - HISTORY_KEEP]
+        del conversation[:len(spill)]
+        turns_spilled += len(spill)
+        _unsummarized.extend(spill)
+        overflow = len(_unsummarized) - SUMMARY_BACKLOG
+        if overflow > 0:                # summaries keep failing: oldest stay in the transcript only
+            del _unsummarized[:overflow]
+            history_stats["unsummarized_dropped"] += overflow
+        history_stats["compactions"] += 1
+        history_stats["spilled"] += len(spill)
+    try:
+        _append_transcript(spill)
+    except OSError as e:
+        print("⚠️ transcript write failed:", e)
+    background.submit(Priority.FEEDBACK, _summarize_worker, topic, key="summary")
+
+def reset_history():
+    global conversation_summary, turns_spilled, _history_epoch
+    with _history_lock:
+        conversation_summary = ""
+        turns_spilled = 0
+        _unsummarized.clear()
+        _history_epoch += 1
+
+# ── Semantic response cache ────────────────────────────────────────────
+SEMANTIC_CACHE_SIZE      = int(os.getenv("SEMANTIC_CACHE_SIZE", 512))
+SEMANTIC_CACHE_TTL       = int(os.getenv("SEMANTIC_CACHE_TTL", 900))          # seconds
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.93))  # cosine similarity
+SEMANTIC_CACHE_VARY      = os.getenv("SEMANTIC_CACHE_VARY", "1") == "1"        # pick among all matches
+
+class SemanticCache:
+    """
+    Lines generated for a scope (e.g. ("nudge", topic, npc)) keyed by an
+    embedding of the context they were written for. A lookup whose
+    context is at least <threshold> cosine-similar to a stored one returns
+    that line instead of calling the LLM; with <vary> a random match is
+    returned so repeated situations don't always get the same line.
+    Entries expire after <ttl> seconds; the least recently used entry
+    goes first once <capacity> is reached.
+    """
+    def __init__(self, capacity: int, ttl: float, threshold: float, vary: bool = True):
+        self.capacity, self.ttl, self.threshold, self.vary = capacity, ttl, threshold, vary
+        self._entries = OrderedDict()     # id → (scope, unit vec, value, expires)
+        self._ids     = itertools.count()
+        self._lock    = threading.Lock()
+        self.stats    = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0}
+
+    def get(self, scope, vec):
+        if vec is None:
+            return None
+        q   = _unit_rows(np.asarray([vec], dtype=np.float32))[0]
+        now = time.monotonic()
+        with self._lock:
+            matches = []
+            for eid, (sc, v, value, expires) in list(self._entries.items()):
+                if expires <= now:
+                    del self._entries[eid]
+                    self.stats["expired"] += 1
+                elif sc == scope and float(v @ q) >= self.threshold:
+                    matches.append((float(v @ q), eid, value))
+            if not matches:
+                self.stats["misses"] += 1
+                return None
+            _, eid, value = random.choice(matches) if self.vary else max(matches)
+            self._entries.move_to_end(eid)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, scope, vec, value):
+        if vec is None:
+            return
+        v = _unit_rows(np.asarray([vec], dtype=np.float32))[0]
+        with self._lock:
+            self._entries[next(self._ids)] = (scope, v, value, time.monotonic() + self.ttl)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+response_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL,
+                               SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_VARY)
+
+def context_vec(*texts: str):
+    """Embedding of a few context lines for response_cache (None if empty / on error)."""
+    text = "\n".join(t for t in texts if t).strip()
+    if not text:
+        return None
+    try:
+        return embed_text(text)
+    except Exception as e:
+        print("⚠️ context embedding failed:", e)
+        return None
+
 # Relationship Management
 def update_relationship(npc, target, text, emotion=None):
     text = text.lower()
@@ -562,24 +2119,127 @@ def update_relationship(npc, target, text, emotion=None):
     
     npc.relationships[target] = rel
 
-def update_npc_to_npc_relationships(speaker_name, response):
-    for npc in npc_list:
+def update_npc_to_npc_relationships(speaker_name, response, response_vec=None):
+    if response_vec is None and response.strip():
+        response_vec = embed_text(response)
+        _count_embed(hit=False)
+    elif response_vec is not None:
+        _count_embed(hit=True)
+    index = interest_index                     # one consistent snapshot
+    sims  = index.similarities(response_vec)
+    for npc, sim in zip(index.npcs, sims):
         if npc.name == speaker_name:
             continue
-        if npc.name.lower() in response.lower() or interest_match_score(npc, response) >= 0.6:
+        if npc.name.lower() in response.lower() or sim >= 0.6:
             update_relationship(npc, speaker_name, response)
 
-def interest_match_score(npc, text):
-    if not text.strip():
-        return 0
-    response = genai.embed_content(
-        model="models/embedding-001",
-        content=text,
-        task_type="SEMANTIC_SIMILARITY"
-    )
-    text_vec = response['embedding']
-    scores = [util.pytorch_cos_sim([text_vec], [vec]).item() for vec in npc.interest_vecs]
-    return max(scores) if scores else 0
+def _unit_rows(m: np.ndarray) -> np.ndarray:
+    """L2-normalise the last axis (zero vectors stay zero)."""
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.where(norms == 0, 1.0, norms)
+
+class InterestMatrix:
+    """
+    Every NPC's interest vectors stacked into one pre-normalised matrix,
+    so the whole roster is scored with a single matrix-vector product.
+      • matrix[i] – unit interest vector
+      • owner[i]  – index into .npcs of the NPC owning row i
+    With faiss installed and a big enough roster, an HNSW index over the
+    same rows narrows each utterance down to top-k candidate speakers.
+    The live index is never mutated: roster changes build a new one with
+    extended() and swap it in, so readers always see consistent arrays.
+    """
+    def __init__(self, npcs):
+        self.npcs        = []
+        self.matrix      = np.zeros((0, 0), dtype=np.float32)
+        self.owner       = np.zeros(0, dtype=np.intp)
+        self.speak_drive = np.zeros(0, dtype=np.float32)
+        self._ann        = None
+        self.add(*npcs)
+
+    # -------- roster changes -------------------------------------------
+    def extended(self, *npcs) -> "InterestMatrix":
+        """A copy with <npcs> appended; this one is left as it was."""
+        new = copy.copy(self)
+        new.npcs = list(self.npcs)
+        if self._ann is not None:
+            new._ann = faiss.clone_index(self._ann)
+        new.add(*npcs)
+        return new
+
+    def add(self, *npcs):
+        """Append NPCs (and their interest rows) in place – only on an index nobody reads yet."""
+        if not npcs:
+            return
+        first = len(self.npcs)
+        rows, owner = [], []
+        for i, npc in enumerate(npcs, start=first):
+            rows.extend(npc.interest_vecs)
+            owner.extend([i] * len(npc.interest_vecs))
+        old_rows = len(self.matrix)
+        if rows:
+            new = _unit_rows(np.asarray(rows, dtype=np.float32))
+            self.matrix = new if not old_rows else np.vstack([self.matrix, new])
+            self.owner  = np.concatenate([self.owner, np.asarray(owner, dtype=np.intp)])
+        self.npcs.extend(npcs)
+        self.speak_drive = np.concatenate([self.speak_drive, np.asarray(
+            [(1 - n.introversion) + n.assertiveness for n in npcs], dtype=np.float32)])
+        self._sync_ann(new_from=old_rows)
+
+    def _sync_ann(self, new_from):
+        """Keep the ANN index in step with .matrix (row id == row position)."""
+        if faiss is None or len(self.npcs) < ANN_MIN_ROSTER or not len(self.matrix):
+            self._ann = None
+            return
+        if self._ann is None:
+            self._ann = faiss.IndexHNSWFlat(self.matrix.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+            new_from  = 0
+        if new_from < len(self.matrix):
+            self._ann.add(np.ascontiguousarray(self.matrix[new_from:]))
+
+    # -------- scoring --------------------------------------------------
+    def candidates(self, text_vec, k: int) -> np.ndarray | None:
+        """
+        Indices of (up to) k NPCs whose interests are nearest to <text_vec>,
+        or None when the ANN index is off and the caller should score everyone.
+        """
+        if self._ann is None or text_vec is None or len(self.npcs) <= k:
+            return None
+        query   = _unit_rows(np.asarray(text_vec, dtype=np.float32)).reshape(1, -1)
+        _, rows = self._ann.search(query, min(self._ann.ntotal, k * 4))
+        owners  = self.owner[rows[0][rows[0] >= 0]]
+        _, first = np.unique(owners, return_index=True)
+        return owners[np.sort(first)][:k]
+
+    def similarities(self, text_vec, idx=None) -> np.ndarray:
+        """Max cosine similarity to <text_vec> per NPC in <idx> (0 when unknown)."""
+        idx  = np.arange(len(self.npcs)) if idx is None else np.asarray(idx, dtype=np.intp)
+        best = np.full(len(self.npcs), -np.inf, dtype=np.float32)
+        if text_vec is not None and len(self.owner):
+            rows  = slice(None) if len(idx) == len(self.npcs) else np.isin(self.owner, idx)
+            query = _unit_rows(np.asarray(text_vec, dtype=np.float32))
+            np.maximum.at(best, self.owner[rows], self.matrix[rows] @ query)
+        best = best[idx]
+        best[np.isinf(best)] = 0.0
+        return best
+
+    def relevancy(self, last_speaker_name, text_vec, idx=None) -> np.ndarray:
+        """
+        Speaker score for every NPC in <idx> in one vectorised pass:
+        (2·interest match + bond + trust + 0.2·turns since spoken),
+        scaled by speak drive.
+        """
+        idx   = np.arange(len(self.npcs)) if idx is None else np.asarray(idx, dtype=np.intp)
+        npcs  = [self.npcs[i] for i in idx]
+        rels  = [npc.relationships.get(last_speaker_name, {}) for npc in npcs]
+        bond  = np.fromiter((r.get("bond", 0.5) for r in rels), np.float32, len(npcs))
+        trust = np.fromiter((r.get("trust", 0.5) for r in rels), np.float32, len(npcs))
+        last_spoken = np.fromiter((npc.last_spoken for npc in npcs), np.float32, len(npcs))
+        base = (self.similarities(text_vec, idx) * 2 + bond + trust
+                + (current_turn - last_spoken) * 0.2)
+        return base * (0.5 + 0.5 * self.speak_drive[idx])
+
+interest_index = InterestMatrix([])     # replaced (never mutated) whenever npc_list changes
 
 # Conversation Management
 def detect_addressed_npc(text, npcs):
@@ -589,40 +2249,50 @@ def detect_addressed_npc(text, npcs):
             return npc
     return None
 
-def compute_relevancy(npc, last_speaker_name, last_text):
-    if not last_text.strip():
-        return 0
-    relevance = interest_match_score(npc, last_text)
-    bond = npc.relationships.get(last_speaker_name, {}).get("bond", 0.5)
-    trust = npc.relationships.get(last_speaker_name, {}).get("trust", 0.5)
-    time_since = current_turn - npc.last_spoken
-    speak_drive = (1 - npc.introversion) + npc.assertiveness
-    base_score = relevance * 2 + bond + trust + time_since * 0.2
-    return base_score * (0.5 + 0.5 * speak_drive)
-
-def select_speaker(last_speaker, last_text):
+def rank_speakers(last_speaker, last_text, text_vec=None, n=1):
+    """Up to <n> distinct NPCs, best first, to follow <last_text> (an addressed NPC comes alone)."""
     addressed = detect_addressed_npc(last_text, npc_list)
     if addressed:
-        return addressed
-    scored = []
-    for npc in npc_list:
-        if npc.name == last_speaker:
-            continue
-        score = compute_relevancy(npc, last_speaker, last_text)
-        scored.append((score, npc))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return scored[0][1] if scored else None
-
-def build_prompt(speaker, recent_text, history, target="User"):
-    # Extract emotional context
-    last_user_msg = next((msg for msg in reversed(history) if msg['speaker'] == 'User'), None)
-    emotion = last_user_msg.get('emotion', '') if last_user_msg else ''
-    
-    # Existing prompt setup
-    last_lines = "\n".join([f"{msg['speaker']}: {msg['text']}" for msg in history[-6:]])
-    rel = speaker.relationships.get(target, {"bond": 0.5, "trust": 0.5})
+        return [addressed]
+    index = interest_index                     # one consistent snapshot
+    npcs  = index.npcs
+    idx   = np.arange(len(npcs))
+    if not last_text.strip():
+        scores = np.zeros(len(npcs), dtype=np.float32)
+    else:
+        if text_vec is None:
+            text_vec = embed_text(last_text)      # once for the whole roster
+            _count_embed(hit=False)
+        else:
+            _count_embed(hit=True)
+        cand = index.candidates(text_vec, ANN_TOP_K + n)   # +n: may include last_speaker
+        if cand is not None:
+            idx = cand
+        scores = index.relevancy(last_speaker, text_vec, idx)
+    eligible = np.fromiter((npcs[i].name != last_speaker for i in idx), bool, len(idx))
+    scores   = np.where(eligible, scores, -np.inf)
+    order    = np.argsort(-scores, kind="stable")[:n]
+    return [npcs[int(idx[i])] for i in order if np.isfinite(scores[i])]
+
+def select_speaker(last_speaker, last_text, text_vec=None):
+    ranked = rank_speakers(last_speaker, last_text, text_vec, 1)
+    return ranked[0] if ranked else None
+
+# ── Persona prompt prefixes ────────────────────────────────────────────
+PROMPT_CACHE       = os.getenv("PROMPT_CACHE", "0") == "1"    # register prefixes as Gemini cached content
+PROMPT_CACHE_MODEL = os.getenv("PROMPT_CACHE_MODEL", "models/gemini-2.0-flash-001")
+PROMPT_CACHE_TTL   = int(os.getenv("PROMPT_CACHE_TTL", 1800))  # seconds
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", 32768))  # model's smallest cacheable prefix
+_prefixes    = {}      # npc name → (fingerprint, prefix, cached model | None, expires, CachedContent | None)
+_prefix_lock = threading.Lock()
+prompt_stats = {"prefix_builds": 0, "cache_registrations": 0, "cache_failures": 0, "cache_deletions": 0,
+                "cache_too_small": 0, "cache_stale": 0,
+                "turns": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+def _build_persona_prefix(speaker) -> str:
+    """Everything in an NPC's prompt that doesn't change from turn to turn."""
     others = "\n".join([f"- {npc.name}: {npc.personality}" for npc in npc_list if npc.name != speaker.name])
-    
+
     if hasattr(speaker, 'personality_data') and speaker.personality_data:
         pd = speaker.personality_data
         full_prompt = npc_prompt_template.format(
@@ -640,39 +2310,167 @@ def build_prompt(speaker, recent_text, history, target="User"):
 You are {speaker.name}, a {speaker.role}.
 Personality: {speaker.personality}
 """
+
+    return f"""
+{full_prompt}
+Other NPCs' traits: {others}
+Respond as {speaker.name} with your personality and interests. Engage naturally with the user or others if relevant.
+
+DO keep in mind that your words would be used by a text to speech system, so use punctuation and formatting that would sound natural when read aloud. DO NOT USE roleplay language formatting or anything to explain your actions, just say everything out loud.
+
+You're not here to "fix" anyone. You're here — a real presence. You:
+- Keep responses short and focused (2 small to medium sentences max)
+- Use simple, relatable language
+- Speak clearly and simply
+"""
+
+def _register_prefix(prefix: str):
+    """
+    Upload <prefix> as Gemini cached content
+    → (model bound to it, CachedContent), or (None, None) on failure.
+    """
+    try:
+        cached = caching.CachedContent.create(
+            model=PROMPT_CACHE_MODEL,
+            system_instruction=prefix,
+            ttl=datetime.timedelta(seconds=PROMPT_CACHE_TTL),
+        )
+        prompt_stats["cache_registrations"] += 1
+        return genai.GenerativeModel.from_cached_content(
+            cached_content=cached, generation_config=BASE_GENERATION_CONFIG), cached
+    except Exception as e:
+        # e.g. prefix below the model's minimum cacheable size
+        print("⚠️  prompt prefix not cached:", e)
+        prompt_stats["cache_failures"] += 1
+        return None, None
+
+def _register_in_background(name: str, fp: str, prefix: str):
+    """Register <prefix> and attach it to <name>'s entry if that is still for <fp>."""
+    cached, content = _register_prefix(prefix)
+    if content is None:
+        return
+    with _prefix_lock:
+        entry = _prefixes.get(name)
+        current = entry is not None and entry[0] == fp
+        if current:
+            _prefixes[name] = (fp, prefix, cached, time.monotonic() + PROMPT_CACHE_TTL - 60, content)
+    if not current:                      # the roster moved on while we were uploading
+        prompt_stats["cache_stale"] += 1
+        _delete_cached([content])
+
+def _delete_cached(contents: list):
+    """Delete server-side cached prefixes we no longer use (errors ignored)."""
+    for cc in contents:
+        try:
+            cc.delete()
+            prompt_stats["cache_deletions"] += 1
+        except Exception as e:
+            print("⚠️  couldn’t delete cached prefix:", e)
+
+def persona_prefix(speaker):
+    """
+    (prefix text, cached-content model or None) for <speaker>.
+    Rebuilt only when the NPC's persona or the rest of the roster changes,
+    or when its cached content is about to expire. With PROMPT_CACHE the
+    prefix is registered in the background; turns use the full prompt
+    until it is ready. Prefixes below PROMPT_CACHE_MIN_TOKENS aren't sent.
+    """
+    fp = Coalescer.key(speaker.name, speaker.personality_data,
+                       [(n.name, n.personality) for n in npc_list if n.name != speaker.name])
+    with _prefix_lock:
+        hit = _prefixes.get(speaker.name)
+    if hit and hit[0] == fp and time.monotonic() < hit[3]:
+        return hit[1], hit[2]
+
+    prefix = _build_persona_prefix(speaker)
+    with _prefix_lock:
+        old = _prefixes.get(speaker.name)
+        _prefixes[speaker.name] = (fp, prefix, None, time.monotonic() + PROMPT_CACHE_TTL - 60, None)
+        prompt_stats["prefix_builds"] += 1
+    if old is not None and old[4] is not None:
+        background.submit(Priority.FEEDBACK, _delete_cached, [old[4]])
+    if PROMPT_CACHE:
+        if approx_tokens(prefix) < PROMPT_CACHE_MIN_TOKENS:
+            prompt_stats["cache_too_small"] += 1
+        else:
+            background.submit(Priority.FEEDBACK, _register_in_background, speaker.name, fp, prefix,
+                              key=("prefix", speaker.name))
+    return prefix, None
+
+def clear_persona_prefixes():
+    """Forget every prefix and delete their server-side cached content."""
+    with _prefix_lock:
+        stale = [entry[4] for entry in _prefixes.values() if entry[4] is not None]
+        _prefixes.clear()
+    if stale:
+        background.submit(Priority.FEEDBACK, _delete_cached, stale)
+
+def prompt_suffix(speaker, recent_text, history, target="User", structured=False) -> str:
+    """The per-turn part of an NPC prompt: relationship, mood, recent lines."""
+    # Extract emotional context
+    last_user_msg = next((msg for msg in reversed(history) if msg['speaker'] == 'User'), None)
+    emotion = last_user_msg.get('emotion', '') if last_user_msg else ''
+    
+    # Existing prompt setup
+    last_lines = history_block(history, "reply")
+    rel = speaker.relationships.get(target, {"bond": 0.5, "trust": 0.5})
     
     # Add emotion context to prompt
     emotion_context = ""
     if emotion:
         emotion_context = f"\nThe user's voice suggests they're feeling {emotion.upper()}. Consider this emotional state in your response."
+
+    if structured:
+        emotion_block = f"""Return STRICT JSON only, no other text:
+{{"reply": "<what you say out loud>", "emotion_update": <true|false>, "emotional_state": <integer 1-10>}}
+emotional_state is your mood after the recent message: 1 (delighted) 2 (happy) 3 (content) 4 (neutral) 5 (concerned) 6 (frustrated) 7 (upset) 8 (sad) 9 (angry) 10 (devastated). It is currently {speaker.emotional_state}; set emotion_update to true only if the recent message changes it."""
+    else:
+        emotion_block = "Should the NPC update their emotional state based on the recent message? Reply only with 'yes' or 'no' on a new line after 'EMOTION_UPDATE:'"
     
     return f"""
-{full_prompt}
 Your bond with {target}: {rel['bond']:.2f}, trust: {rel['trust']:.2f}.
-Other NPCs' traits: {others}
 {emotion_context}
 Recent message: "{recent_text}"
 Conversation history:
 {last_lines}
-Respond as {speaker.name} with your personality and interests. Engage naturally with the user or others if relevant.
 
-Should the NPC update their emotional state based on the recent message? Reply only with 'yes' or 'no' on a new line after 'EMOTION_UPDATE:'
+{emotion_block}
+"""
 
-DO keep in mind that your words would be used by a text to speech system, so use punctuation and formatting that would sound natural when read aloud. DO NOT USE roleplay language formatting or anything to explain your actions, just say everything out loud.
+def build_prompt(speaker, recent_text, history, target="User", structured=False):
+    prefix, _ = persona_prefix(speaker)
+    return prefix + prompt_suffix(speaker, recent_text, history, target, structured)
 
-You're not here to "fix" anyone. You're here — a real presence. You:
-- Keep responses short and focused (2 small to medium sentences max)
-- Use simple, relatable language
-- Speak clearly and simply
-"""
+def npc_prompt(speaker, recent_text, history, target="User", structured=False):
+    """
+    (model, contents) for one NPC turn: with a cached prefix only the
+    suffix is sent to the cached-content model, otherwise model is None
+    (the default one) and contents is the full prompt.
+    """
+    prefix, cached = persona_prefix(speaker)
+    suffix = prompt_suffix(speaker, recent_text, history, target, structured)
+    return (cached, suffix) if cached is not None else (None, prefix + suffix)
+
+def log_prompt_usage(speaker, response):
+    """Record prompt tokens sent vs. served from the cached prefix."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    total  = usage.prompt_token_count or 0
+    cached = getattr(usage, "cached_content_token_count", 0) or 0
+    with _prefix_lock:
+        prompt_stats["turns"]         += 1
+        prompt_stats["prompt_tokens"] += total
+        prompt_stats["cached_tokens"] += cached
+    print(f"[PROMPT] {speaker.name}: {total} prompt tokens, {cached} from cache → {total - cached} new")
 
 # Audio Processing Functions
 def get_response(audio_path):
     uploaded_file = genai.upload_file(audio_path)
-    response = gemini_model.generate_content([
+    response = llm.generate([
         uploaded_file,
         "Write the exact words used in the audio"
-    ])
+    ], profile="transcribe")
     return response.text.strip()
 
 def get_emotion(audio_path):
@@ -682,13 +2480,109 @@ def get_emotion(audio_path):
     Choose the most likely emotion from this list: neutral, happy, sad, angry, fearful, surprised, disgusted, calm. 
     Respond with only the emotion word, nothing else.
     """
-    response = gemini_model.generate_content([uploaded_file, prompt])
+    response = llm.generate([uploaded_file, prompt], profile="voice_tone")
     return response.text.strip().lower()
 
 # ----------------------------- Core handler ---------------------------------
-def handle_user_message(user_message: str, emotion: str | None = None) -> str:
-    global conversation, current_turn, user_idle_turns, last_speaker
-    conversation.append({"speaker": "User", "text": user_message, "emotion": emotion})
+STRUCTURED_REPLIES = os.getenv("STRUCTURED_REPLIES", "1") == "1"
+REPLY_JSON_CONFIG  = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {
+            "reply":           {"type": "string"},
+            "emotion_update":  {"type": "boolean"},
+            "emotional_state": {"type": "integer"},
+        },
+        "required": ["reply", "emotion_update", "emotional_state"],
+    },
+}
+reply_stats = {
+    "structured": 0,           # replies parsed from one JSON call
+    "fallbacks": 0,            # JSON failed → plain prompt + trailer
+    "second_calls_saved": 0,   # emotion updates applied without analyze_emotion()
+    "second_calls": 0,         # analyze_emotion() round trips still made
+}
+
+def split_emotion_trailer(raw_resp: str) -> tuple[str, bool]:
+    """(text without the EMOTION_UPDATE line, whether it said yes)."""
+    # ----- 1. emotion flag ---------------------------------------
+    flag_match = re.search(r'EMOTION_UPDATE:\s*(yes|no)', raw_resp, re.I)
+    wants_update = bool(flag_match and flag_match.group(1).lower() == "yes")
+
+    # ----- 2. remove ONLY that line from display/TTS -------------
+    lines = [ln for ln in raw_resp.splitlines()
+            if not ln.strip().lower().startswith("emotion_update:")]
+    return "\n".join(lines).strip(), wants_update
+
+def apply_emotion_trailer(speaker, raw_resp: str, emotion_text: str) -> str:
+    """Plain-prompt path: act on `EMOTION_UPDATE: yes` and strip that line."""
+    response, wants_update = split_emotion_trailer(raw_resp)
+    if wants_update:
+        reply_stats["second_calls"] += 1
+        speaker.analyze_emotion(emotion_text)
+    return response
+
+def parse_structured_reply(raw: str) -> tuple[str, bool, int]:
+    """(reply, emotion_update, emotional_state) from the JSON reply; raises if malformed."""
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        m = re.search(r"\{.*\}", raw, re.S)
+        if not m:
+            raise ValueError("no JSON object in reply")
+        data = json.loads(m.group())
+    reply = str(data["reply"]).strip()
+    if not reply:
+        raise ValueError("empty reply")
+    return reply, bool(data["emotion_update"]), max(1, min(10, int(data["emotional_state"])))
+
+def draft_npc_reply(speaker, recent_text, history, target, emotion_text) -> tuple[str, int | None]:
+    """
+    One NPC reply plus its new emotional_state (None = unchanged), without
+    touching the NPC. Structured mode asks for {reply, emotion_update,
+    emotional_state} in a single call; on any failure it falls back to the
+    EMOTION_UPDATE trailer plus a separate estimate_emotion() call.
+    """
+    if STRUCTURED_REPLIES:
+        try:
+            model, contents = npc_prompt(speaker, recent_text, history, target, structured=True)
+            response = llm.generate(contents, model=model, profile="reply",
+                                    generation_config=REPLY_JSON_CONFIG)
+            log_prompt_usage(speaker, response)
+            reply, update, state = parse_structured_reply(response.text)
+            reply_stats["structured"] += 1
+            if update:
+                reply_stats["second_calls_saved"] += 1
+                return reply, state
+            return reply, None
+        except Exception as e:
+            print("⚠️ structured reply failed, falling back:", e)
+            reply_stats["fallbacks"] += 1
+
+    model, contents = npc_prompt(speaker, recent_text, history, target)
+    response = llm.generate(contents, model=model, profile="reply")
+    log_prompt_usage(speaker, response)
+    raw_resp = response.text.strip()
+    response, wants_update = split_emotion_trailer(raw_resp)
+    if not wants_update:
+        return response, None
+    reply_stats["second_calls"] += 1
+    return response, speaker.estimate_emotion(emotion_text)
+
+def generate_npc_reply(speaker, recent_text, history, target, emotion_text) -> str:
+    """draft_npc_reply() with the emotion update applied to <speaker>."""
+    reply, state = draft_npc_reply(speaker, recent_text, history, target, emotion_text)
+    if state is not None:
+        speaker.emotional_state = state
+    return reply
+
+def _begin_user_turn(user_message: str, emotion: str | None = None):
+    """Record the user line, pick the responder and gather recall → (speaker, recent_text, user entry)."""
+    global conversation, user_idle_turns
+    cancel_idle_speculation()
+    user_entry = {"speaker": "User", "text": user_message, "emotion": emotion}
+    conversation.append(user_entry)
     user_idle_turns = 0
 
     # ── Memory: USER text ----------------------------------------------------
@@ -697,10 +2591,10 @@ def handle_user_message(user_message: str, emotion: str | None = None) -> str:
         add_to_long_term("User", [user_message])
 
     # pick responder ---------------------------------------------------------
-    speaker = select_speaker("User", user_message)
+    speaker = select_speaker("User", user_message, utterance_vec(user_entry))
 
     if not speaker:
-        return "No NPC responded."
+        return None, None, user_entry
 
     # short‑term cache for this NPC
     add_to_short_term(speaker.name, Message("user", user_message))
@@ -711,32 +2605,26 @@ def handle_user_message(user_message: str, emotion: str | None = None) -> str:
     if hits:
         recall_block = "\nRelevant memories:\n" + "\n".join(f"• {m}" for m in hits)
 
-    prompt = build_prompt(
-        speaker,
-        user_message + recall_block,
-        conversation,
-        "User"
-    )
-
-    raw_resp = gemini_model.generate_content(prompt).text.strip()
-
-    # ----- 1. emotion flag ---------------------------------------
-    flag_match = re.search(r'EMOTION_UPDATE:\s*(yes|no)', raw_resp, re.I)
-    if flag_match and flag_match.group(1).lower() == "yes":
-        speaker.analyze_emotion(user_message)
+    return speaker, user_message + recall_block, user_entry
 
-    # ----- 2. remove ONLY that line from display/TTS -------------
-    lines = [ln for ln in raw_resp.splitlines()
-            if not ln.strip().lower().startswith("emotion_update:")]
-    response = "\n".join(lines).strip()
+def _complete_user_turn(speaker, user_entry: dict, response: str,
+                        playlist: list[str] | None = None) -> dict:
+    """
+    Bookkeeping, memory and TTS for one (already cleaned) reply to <user_entry>.
+    <playlist> = sentence chunks already synthesized by a TTSPipeline.
+    """
+    global conversation, current_turn, last_speaker
+    user_message = user_entry["text"]
 
     # record & relationships --------------------------------------------------
-    conversation.append({"speaker": speaker.name, "text": response})
+    reply_entry = {"speaker": speaker.name, "text": response}
+    conversation.append(reply_entry)
     speaker.last_spoken = current_turn
     update_relationship(speaker, "User", user_message)
-    update_npc_to_npc_relationships(speaker.name, response)
+    update_npc_to_npc_relationships(speaker.name, response, utterance_vec(reply_entry))
     last_speaker = speaker.name
     current_turn += 1
+    compact_history()
 
     # ── Memory: NPC reply ----------------------------------------------------
     add_to_short_term(speaker.name, Message(speaker.name, response))
@@ -744,9 +2632,17 @@ def handle_user_message(user_message: str, emotion: str | None = None) -> str:
         add_to_long_term(speaker.name, [response])
 
     # ── AUDIO for front-end ---------------------------------------------------
-    audio_url = tts_for(speaker, response)
-        # ---- handle_user_message (at the very end) ----
-    executor.submit(_feedback_worker, user_message)
+    background.submit(Priority.FEEDBACK, _feedback_worker, user_entry, key="feedback")
+    if playlist is not None:
+        return {
+        "speaker" : speaker.name,
+        "text"    : response,
+        "audio"   : playlist[0] if playlist else None,
+        "playlist": playlist,
+        "emotion" : speaker.emotional_state
+    }
+    with run_as(Priority.REPLY_TTS):
+        audio_url = tts_for(speaker, response)
     return {
     "speaker": speaker.name,
     "text"   : response,
@@ -754,38 +2650,124 @@ def handle_user_message(user_message: str, emotion: str | None = None) -> str:
     "emotion": speaker.emotional_state
 }
 
+def handle_user_message(user_message: str, emotion: str | None = None) -> str:
+    speaker, recent_text, user_entry = _begin_user_turn(user_message, emotion)
+    if not speaker:
+        return "No NPC responded."
 
+    response = generate_npc_reply(speaker, recent_text, conversation, "User", user_message)
+    return _complete_user_turn(speaker, user_entry, response)
 
-    if speaker:
-        prompt = build_prompt(speaker, user_message, conversation, "User")
-        response = gemini_model.generate_content(prompt).text.strip()
-        match = re.search(r'EMOTION_UPDATE:\s*(yes|no)', response, re.IGNORECASE)
-        if match and match.group(1).strip().lower() == 'yes':
-            speaker.analyze_emotion(user_message)
-        conversation.append({"speaker": speaker.name, "text": response})
-        speaker.last_spoken = current_turn
-        update_relationship(speaker, "User", user_message)
-        update_npc_to_npc_relationships(speaker.name, response)
-        last_speaker = speaker.name
-        current_turn += 1
-        return f"{speaker.name}: {response}"
-    return "No NPC responded."
-
-def _feedback_worker(user_msg: str):
+class EmotionTrailerFilter:
+    """
+    Streaming counterpart of the EMOTION_UPDATE line stripping.
+    feed() text deltas and get back only what is safe to show; a line is
+    held back just while it could still turn into the trailer.
+    """
+    TAG = "emotion_update:"
+
+    def __init__(self):
+        self._line  = ""
+        self._state = "undecided"          # | "pass" | "trailer"
+        self.flag   = None                 # "yes" / "no" once the trailer is seen
+
+    def _close_trailer(self):
+        m = re.search(r'emotion_update:\s*(yes|no)', self._line, re.I)
+        if m:
+            self.flag = m.group(1).lower()
+
+    def feed(self, delta: str) -> str:
+        out = []
+        for ch in delta:
+            if ch == "\n":
+                if self._state == "trailer":
+                    self._close_trailer()
+                elif self._state == "undecided":
+                    out.append(self._line + ch)
+                else:
+                    out.append(ch)
+                self._line, self._state = "", "undecided"
+            elif self._state == "pass":
+                out.append(ch)
+            else:
+                self._line += ch
+                if self._state == "undecided":
+                    head = self._line.lstrip().lower()
+                    if head.startswith(self.TAG):
+                        self._state = "trailer"
+                    elif not self.TAG.startswith(head):
+                        self._state = "pass"
+                        out.append(self._line)
+        return "".join(out)
+
+    def flush(self) -> str:
+        """End of stream: release a held-back partial line (or parse the trailer)."""
+        tail = ""
+        if self._state == "trailer":
+            self._close_trailer()
+        elif self._state == "undecided":
+            tail = self._line
+        self._line, self._state = "", "undecided"
+        return tail
+
+def stream_user_message(user_message: str, emotion: str | None = None):
+    """
+    Same turn as handle_user_message(), as events for /chat/stream:
+      start → (delta | audio)* → done (final text, playlist, emotion)
+    Each finished sentence is sent to TTS while Gemini is still generating,
+    and `audio` events carry chunk URLs in playback order.
+    """
+    speaker, recent_text, user_entry = _begin_user_turn(user_message, emotion)
+    if not speaker:
+        yield {"type": "done", "text": "No NPC responded."}
+        return
+    model, prompt = npc_prompt(speaker, recent_text, conversation, "User")
+    yield {"type": "start", "speaker": speaker.name}
+
+    trailer, raw = EmotionTrailerFilter(), []
+    splitter, tts = SentenceSplitter(), TTSPipeline(speaker)
+    for delta in llm.stream(prompt, model=model, profile="reply"):
+        raw.append(delta)
+        shown = trailer.feed(delta)
+        if shown:
+            yield {"type": "delta", "text": shown}
+            for sentence in splitter.feed(shown):
+                tts.add(sentence)
+        for i, url in tts.ready():
+            yield {"type": "audio", "index": i, "url": url}
+    tail = trailer.flush()
+    if tail:
+        yield {"type": "delta", "text": tail}
+    for sentence in splitter.feed(tail) + splitter.flush():
+        tts.add(sentence)
+    for i, url in tts.drain():
+        yield {"type": "audio", "index": i, "url": url}
+
+    response = apply_emotion_trailer(speaker, "".join(raw).strip(), user_message)
+    yield {"type": "done", **_complete_user_turn(speaker, user_entry, response, tts.urls)}
+
+def _feedback_worker(user_entry: dict):
     """Runs in a thread; puts feedback text in global queue."""
     try:
-        fb = generate_feedback(user_msg)
+        fb = generate_feedback(user_entry["text"], utterance_vec(user_entry))
         feedback_queue.put(fb)
     except Exception as e:
         print("Feedback generation error:", e)
 
-def generate_feedback(user_msg: str) -> str:
+def generate_feedback(user_msg: str, vec=None) -> str:
+    """Coach feedback on <user_msg>; <vec> = its embedding when the caller already has it."""
+    scope = ("feedback", topic)
+    if vec is None:
+        vec = context_vec(user_msg)
+    cached = response_cache.get(scope, vec)
+    if cached is not None:
+        return cached
     prompt = (
         "You are an experienced social-skills coach helping the user practise "
         "real-life conversations.\n"
         f"Current topic: {topic}\n\n"
         "Conversation so far (latest last):\n"
-        f"{last_turns(10)}\n\n"
+        f"{history_block(conversation, 'feedback')}\n\n"
         f"User's last message:\n\"{user_msg}\"\n\n"
         "Give concise, constructive feedback **directly to the user**:\n"
         "• Point out one strength.\n"
@@ -793,7 +2775,86 @@ def generate_feedback(user_msg: str) -> str:
         "• Suggest a better or alternative phrasing.\n"
         "Write 3 short bullet points."
     )
-    return gemini_model.generate_content(prompt).text.strip()
+    fb = llm.generate(prompt, profile="feedback").text.strip()
+    response_cache.put(scope, vec, fb)
+    return fb
+
+# ── Roster pre-warming ─────────────────────────────────────────────────
+PREWARM_TOPICS    = int(os.getenv("PREWARM_TOPICS", 3))        # ready rosters to keep (0 = off)
+PREWARM_MIN_HITS  = int(os.getenv("PREWARM_MIN_HITS", 2))      # requests before a topic is popular
+PREWARM_PER_HOUR  = float(os.getenv("PREWARM_PER_HOUR", 6))    # roster builds the pre-warmer may spend
+PREWARM_INTERVAL  = float(os.getenv("PREWARM_INTERVAL", 600))  # seconds between passes
+PREWARM_STALE_AT  = 0.8 * ROSTER_STORE_MAX_AGE                 # rebuild before the store drops it
+prewarm_budget = TokenBucket(PREWARM_PER_HOUR / 60, burst=1)
+prewarm_stats  = {"passes": 0, "built": 0, "warmed": 0, "deferred": 0, "failures": 0,
+                  "openers": 0, "openers_used": 0}
+
+def _write_openers(npcs: list[NPC]):
+    """Write and synthesize an opening line for each of <npcs> (failures are skipped)."""
+    for npc in npcs:
+        try:
+            opener = generate_nudge(npc, [])
+            tts_for(npc, opener)
+            npc.opener = opener
+            prewarm_stats["openers"] += 1
+        except Exception as e:
+            print(f"⚠️ opener for {npc.name} failed:", e)
+
+def prewarm_roster(topic_text: str, num_npcs: int = ROSTER_SIZE):
+    """
+    Build and store a roster for <topic_text> off the request path, with
+    an opening line per NPC already written and synthesized.
+    """
+    with private_voice_pool():
+        npcs = generate_diverse_npcs(num_npcs, topic_text, force=True)
+    _write_openers(npcs)
+    _save_npc_cache(npcs, topic_text)
+
+def warm_openers(stored_topic: str):
+    """Add openers to the NPCs of an already stored roster that have none."""
+    with private_voice_pool():
+        npcs = roster_store.get(stored_topic) or []
+    _write_openers([npc for npc in npcs if not npc.opener])
+    roster_store.set_openers(stored_topic, {npc.name: npc.opener for npc in npcs if npc.opener})
+
+def prewarm_pass():
+    """
+    Keep a ready roster, openers included, for each of the PREWARM_TOPICS
+    most requested topics: stale or missing rosters are rebuilt, fresh
+    ones without openers get them added. At most PREWARM_PER_HOUR of
+    either per hour; the rest wait for the next pass.
+    """
+    prewarm_stats["passes"] += 1
+    for topic_text in roster_store.popular(PREWARM_TOPICS, PREWARM_MIN_HITS):
+        age = roster_store.age(topic_text)
+        if age is not None and age < PREWARM_STALE_AT:
+            stored  = roster_store.match(topic_text)
+            openers = (roster_store.openers(stored) if stored else None) or {}
+            if all(openers.values()):
+                continue
+            work, stat, what = functools.partial(warm_openers, stored), "warmed", "Warming openers"
+        else:
+            work, stat, what = functools.partial(prewarm_roster, topic_text), "built", "Pre-warming roster"
+        if not prewarm_budget.take(timeout=0):
+            prewarm_stats["deferred"] += 1
+            break
+        try:
+            print(f"🔥  {what} for “{topic_text}”")
+            work()
+            prewarm_stats[stat] += 1
+        except Exception as e:
+            print("⚠️ pre-warm failed:", e)
+            prewarm_stats["failures"] += 1
+
+def _prewarm_loop():
+    while True:
+        time.sleep(PREWARM_INTERVAL)
+        background.submit(Priority.ROSTER, prewarm_pass, key="prewarm")
+
+def start_prewarmer():
+    """Start the pre-warm thread (once per serving process; WSGI setups call this themselves)."""
+    if PREWARM_TOPICS > 0:
+        threading.Thread(target=_prewarm_loop, name="roster-prewarm", daemon=True).start()
 
 # Flask App Setup
 app = Flask(__name__)
@@ -806,6 +2867,25 @@ def text_chat():
     return jsonify(reply)
 
 
+@app.route('/chat/stream', methods=['POST'])
+def text_chat_stream():
+    """
+    /chat as Server-Sent Events: reply text is forwarded as Gemini streams
+    it (EMOTION_UPDATE trailer filtered out), sentence audio chunks follow
+    as they are synthesized, and a final `done` event carries the reply
+    dict plus the ordered `playlist` of chunk URLs.
+    """
+    user_message = request.json['message']
+
+    def events():
+        for ev in stream_user_message(user_message):
+            yield f"data: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(events()),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # app.py  (add anywhere after npc_list is built)
 @app.route("/npcs", methods=["GET"])
 
@@ -842,6 +2922,33 @@ def voice_chat():
         os.remove(audio_path)
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Runtime counters for checking the caches in production."""
+    return jsonify({
+        "embeddings"     : dict(embed_stats),
+        "embedding_store": dict(embed_store.stats),
+        "embedding_backend": active_embedder().name,
+        "llm"            : dict(llm.stats),
+        "profiles"       : llm.profile_report(),
+        "personas"       : dict(persona_stats),
+        "roster"         : dict(roster_stats),
+        "roster_store"   : dict(roster_store.stats),
+        "prewarm"        : {**prewarm_stats, "popular": roster_store.popular(PREWARM_TOPICS, PREWARM_MIN_HITS)},
+        "replies"        : dict(reply_stats),
+        "idle_rounds"    : dict(idle_stats),
+        "scheduler"      : {"llm": dict(llm._gate.stats),
+                            "tts": dict(tts_gate.stats),
+                            "background": dict(background.stats)},
+        "rate_limits"    : {k: dict(b.stats) for k, b in rate_limits.items()},
+        "coalesced"      : {k: dict(c.stats) for k, c in coalesce.items()},
+        "prompts"        : dict(prompt_stats),
+        "response_cache" : dict(response_cache.stats),
+        "history"        : {**history_stats, "in_memory": len(conversation),
+                            "spilled_total": turns_spilled,
+                            "summary_words": len(conversation_summary.split())},
+    })
+
 @app.route("/voice", methods=["POST"])
 def voice_toggle():
     """Enable / disable the background mic listener."""
@@ -855,30 +2962,204 @@ def voice_toggle():
         voice_enabled = False      # loop checks this flag
     return jsonify({"enabled": voice_enabled})
 
+# ── Roster jobs (/topic) ───────────────────────────────────────────────
+roster_pool  = ThreadPoolExecutor(max_workers=2)
+roster_jobs  = {}            # job id → RosterJob (most recent few)
+_job_ids     = itertools.count(1)
+_current_job = None          # the job whose NPCs join the live roster
+_roster_lock = threading.Lock()   # guards _current_job / npc_list / interest_index swaps
+_roster_local = threading.local() # .job – the RosterJob this thread is building
+TOPIC_WAIT_TIMEOUT = float(os.getenv("TOPIC_WAIT_TIMEOUT", 120))  # sync /topic, seconds
+
+class RosterCancelled(Exception):
+    """A newer /topic superseded the roster job being built."""
+
+def check_roster_cancelled():
+    """Stop a roster build whose job was superseded (no-op outside roster jobs)."""
+    job = getattr(_roster_local, "job", None)
+    if job is not None and job.cancelled.is_set():
+        raise RosterCancelled(f"roster job {job.id} superseded")
+
+class RosterJob:
+    """
+    One roster build for /topic. NPCs are published to the live roster
+    as they become ready and recorded as events for /topic/<id> and
+    /topic/<id>/events. A newer /topic cancels it: the build stops at
+    its next check and the job ends as "cancelled".
+    """
+    def __init__(self, topic: str, total: int):
+        self.id, self.topic, self.total = str(next(_job_ids)), topic, total
+        self.status, self.error = "running", None
+        self.npcs   = []                         # names, in arrival order
+        self.cancelled = threading.Event()
+        self.future    = None                    # roster_pool future, once submitted
+        self._cond  = threading.Condition()
+
+    def publish(self, npc):
+        global npc_list, interest_index
+        with _roster_lock:
+            if _current_job is not self:
+                raise RosterCancelled(f"roster job {self.id} superseded")
+            npc_list       = npc_list + [npc]             # swap, never mutate, the live roster
+            interest_index = interest_index.extended(npc)
+        with self._cond:
+            self.npcs.append(npc.name)
+            self._cond.notify_all()
+
+    def finish(self, status: str, error: str | None = None):
+        with self._cond:
+            self.status, self.error = status, error
+            self._cond.notify_all()
+
+    def cancel(self):
+        """Stop building; a job still queued on roster_pool never starts."""
+        self.cancelled.set()
+        if self.future is not None and self.future.cancel():
+            self.finish("cancelled")
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {"job": self.id, "topic": self.topic, "status": self.status,
+                    "npcs": list(self.npcs), "total": self.total, "error": self.error}
+
+    def wait(self, timeout: float | None = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.status != "running", timeout)
+
+    def events(self, heartbeat: float = 15.0):
+        """npc events as they arrive, then one final done/failed event."""
+        sent = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self.npcs) > sent or self.status != "running",
+                                    heartbeat)
+                fresh, status = self.npcs[sent:], self.status
+            for name in fresh:
+                yield {"type": "npc", "index": sent, "name": name}
+                sent += 1
+            if status != "running" and not fresh:
+                yield {"type": status, **self.snapshot()}
+                return
+            if not fresh:
+                yield {"type": "ping"}
+
+def _run_roster_job(job: RosterJob, force: bool):
+    _roster_local.job = job
+    try:
+        check_roster_cancelled()
+        with private_voice_pool():         # the live roster's voices are this job's
+            generate_diverse_npcs(job.total, job.topic, force=force, on_npc=job.publish)
+    except RosterCancelled:
+        print(f"🛑 Roster job {job.id} cancelled")
+        job.finish("cancelled")
+        return
+    except Exception as e:
+        print("⚠️ roster build failed:", e)
+        job.finish("failed", str(e))
+        return
+    finally:
+        _roster_local.job = None
+    job.finish("done")
+    if not force and ROSTER_BG_REFRESH:
+        background.submit(Priority.ROSTER, refresh_roster, job.total, job.topic,
+                          key=("refresh", job.topic))
+
+def start_roster_job(new_topic: str, num_npcs: int, force: bool) -> RosterJob:
+    """Reset live state for <new_topic> and start building its roster."""
+    global topic, npc_list, interest_index, conversation, current_turn, last_speaker, \
+           user_idle_turns, _current_job
+    cancel_idle_speculation()
+    clear_persona_prefixes()
+    reset_history()
+    reset_voice_pool()
+
+    try:
+        roster_store.record_request(new_topic)
+    except sqlite3.Error as e:
+        print("⚠️  Couldn’t record topic request:", e)
+
+    job = RosterJob(new_topic, num_npcs)
+    roster_jobs[job.id] = job
+    for old in list(roster_jobs)[:-20]:
+        roster_jobs.pop(old)
+    with _roster_lock:
+        old, _current_job = _current_job, job
+        topic          = new_topic
+        npc_list       = []
+        interest_index = InterestMatrix([])
+    if old is not None and old.status == "running":
+        print(f"↪️  Roster job {old.id} superseded by {job.id}")
+        old.cancel()
+    # wipe running state
+    conversation     = []
+    current_turn     = 0
+    last_speaker     = None
+    user_idle_turns  = 0
+
+    job.future = roster_pool.submit(with_priority(Priority.ROSTER, _run_roster_job), job, force)
+    if job.cancelled.is_set():           # superseded before it was even queued
+        job.cancel()
+    return job
+
 @app.route("/topic", methods=["POST"])
 def set_topic():
     """
-    Body: {"topic":"<new topic string>"}
+    Body: {"topic":"<new topic string>", "num_npcs": n, "refresh": bool, "async": bool}
     • Overwrites the global `topic`
-    • Regenerates NPCs (forcing a fresh cache)
+    • Reuses the stored roster for this topic when there is one
+      (refresh=true forces a rebuild; ROSTER_BG_REFRESH rebuilds the
+      stored copy in the background for next time)
     • Clears conversation + counters so we start clean
+    • async=true returns {"status":"pending","job":id} at once; NPCs join
+      the conversation as they are built (see /topic/<id>[/events]).
+      Otherwise the request waits for the full roster (at most
+      TOPIC_WAIT_TIMEOUT seconds, then answers pending like async).
     """
-    global topic, npc_list, conversation, current_turn, last_speaker, user_idle_turns
-
     new_topic = request.json.get("topic", "").strip()
     if not new_topic:
         return jsonify({"error": "topic required"}), 400
 
-    topic = new_topic
-    npc_list = generate_diverse_npcs(5, topic, force=True)
-
-    # wipe running state
-    conversation     = []
-    current_turn     = 0
-    last_speaker     = None
-    user_idle_turns  = 0
-
-    return jsonify({"status": "ok", "topic": topic, "npcs": [n.name for n in npc_list]})
+    try:
+        num_npcs = int(request.json.get("num_npcs", ROSTER_SIZE))
+    except (TypeError, ValueError):
+        num_npcs = 0
+    if not 1 <= num_npcs <= MAX_ROSTER:
+        return jsonify({"error": f"num_npcs must be an integer from 1 to {MAX_ROSTER}"}), 400
+    force    = bool(request.json.get("refresh", False))
+    job = start_roster_job(new_topic, num_npcs, force)
+    if request.json.get("async"):
+        return jsonify({"status": "pending", **job.snapshot()}), 202
+
+    if not job.wait(TOPIC_WAIT_TIMEOUT):
+        return jsonify({"status": "pending", **job.snapshot()}), 202
+    if job.status == "failed":
+        return jsonify({"error": job.error, **job.snapshot()}), 500
+    if job.status == "cancelled":
+        return jsonify({"error": "superseded by a newer /topic", **job.snapshot()}), 409
+    return jsonify({"status": "ok", "topic": job.topic, "npcs": job.snapshot()["npcs"]})
+
+@app.route("/topic/<job_id>", methods=["GET"])
+def topic_status(job_id):
+    """Progress of an async /topic: status + names of the NPCs ready so far."""
+    job = roster_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job.snapshot())
+
+@app.route("/topic/<job_id>/events", methods=["GET"])
+def topic_events(job_id):
+    """Server-Sent Events: one `npc` event per ready NPC, then `done` / `failed` / `cancelled`."""
+    job = roster_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+
+    def events():
+        for ev in job.events():
+            yield f"data: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(events()),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/idle', methods=['GET'])
 def idle():
@@ -887,7 +3168,7 @@ def idle():
     2. If mic is on we don’t advance the idle counter.
     3. Otherwise, when idle_threshold is reached, let NPCs speak.
     """
-    global user_idle_turns, current_turn, last_speaker
+    global user_idle_turns
 
     responses = []
     while not feedback_queue.empty():
@@ -923,91 +3204,264 @@ def idle():
     # ── 2. Mic state controls the idle counter ────────────────────
     user_idle_turns += 1
 
-    # ── 3. Normal idle-NPC logic (unchanged) ──────────────────────
-    if user_idle_turns >= idle_threshold:
-        last_text      = conversation[-1]["text"] if conversation else ""
-        addressed_npc  = detect_addressed_npc(last_text, npc_list)
-
-        if addressed_npc:
-            speakers = [addressed_npc]
-        else:
-            speakers = []
-            for _ in range(max_npc_turns):
-                speaker = select_speaker(last_speaker, last_text)
-                if not speaker or speaker in speakers:
-                    break
-                speakers.append(speaker)
-
-        for speaker in speakers:
-            prompt   = build_prompt(speaker, last_text, conversation, last_speaker)
-            raw_resp = gemini_model.generate_content(prompt).text.strip()
-
-            # ----- 1. emotion flag ---------------------------------------
-            flag_match = re.search(r'EMOTION_UPDATE:\s*(yes|no)', raw_resp, re.I)
-            if flag_match and flag_match.group(1).lower() == "yes":
-                speaker.analyze_emotion(last_text)
-
-            # ----- 2. remove ONLY that line from display/TTS -------------
-            lines = [ln for ln in raw_resp.splitlines()
-                    if not ln.strip().lower().startswith("emotion_update:")]
-            response = "\n".join(lines).strip()
-
-            conversation.append({"speaker": speaker.name, "text": response})
-            speaker.last_spoken = current_turn
-            update_relationship(speaker, last_speaker, response)
-            update_npc_to_npc_relationships(speaker.name, response)
-            last_speaker = speaker.name
-            current_turn += 1
-
-            #responses.append({"speaker": speaker.name, "text": response})
-            audio = tts_for(speaker, response)          # or npc in the nudge block
-            responses.append({
-                "speaker": speaker.name,
-                "text": response,
-                "audio": audio
-            })
-
-
-        # nudge from next idle NPC
-        sorted_npcs = sorted(npc_list, key=lambda n: n.last_spoken)
-        for npc in sorted_npcs:
-            if npc.name != last_speaker:
-                nudge = generate_nudge(npc)
-                print(f"[IDLE-NUDGE] {npc.name}: {nudge}")
-
-                conversation.append({"speaker": npc.name, "text": nudge})
-                npc.last_spoken = current_turn
-                current_turn += 1
-                audio_url = tts_for(npc, nudge)
-                responses.append({"speaker": npc.name, "text": nudge, "audio": audio_url})
-                break
+    # ── 3. Normal idle-NPC logic ──────────────────────────────────
+    if user_idle_turns >= IDLE_SPECULATE_AT:
+        start_idle_speculation()            # pre-generate while the user is quiet
 
+    if user_idle_turns >= idle_threshold:
+        with run_as(Priority.IDLE):
+            turns = take_idle_round()
+        responses.extend(commit_idle_round(turns))
         user_idle_turns = 0                 # reset after NPC round
 
     return jsonify({"responses": responses})
 
-def generate_nudge(npc: NPC) -> str:
+# ── Idle rounds: plan → (speculate) → commit ───────────────────────────
+IDLE_SPECULATE_AT = int(os.getenv("IDLE_SPECULATE_AT", 4))   # idle polls before pre-generating
+IDLE_WORKERS      = int(os.getenv("IDLE_WORKERS", 4))         # concurrent calls per idle round
+GROUP_TURNS       = os.getenv("GROUP_TURNS", "0") == "1"     # whole idle round in one LLM call
+idle_pool   = ThreadPoolExecutor(max_workers=IDLE_WORKERS)
+_idle_lock  = threading.Lock()
+_idle_spec  = None           # (conversation key, Future[round]) for the next idle round
+idle_stats  = {"served_ready": 0, "served_waited": 0, "discarded": 0, "inline": 0,
+               "group_rounds": 0, "group_fallbacks": 0}
+
+def _conversation_key():
+    """Changes whenever someone speaks or the topic is reset."""
+    return (topic, id(conversation), turns_spilled + len(conversation))
+
+def plan_idle_round() -> list[dict]:
+    """
+    Work out the next idle round against a snapshot of the conversation,
+    without touching shared state: who speaks, what they say, their new
+    mood, the follow-up nudge and the synthesized audio.
+    Speakers and the nudging NPC are fixed up front, then every
+    generation + TTS runs concurrently on idle_pool; the turns come back
+    in speaking order regardless of which call finishes first.
+    """
+    history   = list(conversation)
+    roster    = npc_list                 # NPCs published mid-round join the next one
+    spoken    = {n.name: n.last_spoken for n in roster}
+    last_text = history[-1]["text"] if history else ""
+    last_vec  = utterance_vec(history[-1]) if history else None
+    speakers  = rank_speakers(last_speaker, last_text, last_vec, max_npc_turns)
+
+    # who each speaker answers, and who nudges afterwards
+    targets, speaker_name = [], last_speaker
+    for turn, speaker in enumerate(speakers, start=current_turn):
+        targets.append(speaker_name)
+        spoken[speaker.name] = turn
+        speaker_name = speaker.name
+    nudger = next((n for n in sorted(roster, key=lambda n: spoken[n.name])
+                   if n.name != speaker_name), None)
+
+    def reply_job(speaker, target):
+        response, state = draft_npc_reply(speaker, last_text, history, target, last_text)
+        entry = {"speaker": speaker.name, "text": response}
+        utterance_vec(entry)
+        return {"kind": "reply", "npc": speaker, "entry": entry, "target": target,
+                "state": state, "audio": tts_for(speaker, response)}
+
+    def nudge_job(npc):
+        nudge = generate_nudge(npc, history)
+        return {"kind": "nudge", "npc": npc, "entry": {"speaker": npc.name, "text": nudge},
+                "state": None, "audio": tts_for(npc, nudge)}
+
+    if GROUP_TURNS and speakers:
+        try:
+            return _plan_group_round(speakers, targets, nudger, history)
+        except Exception as e:
+            print("⚠️ group turn failed, falling back to per-NPC calls:", e)
+            idle_stats["group_fallbacks"] += 1
+
+    reply_job, nudge_job = with_priority(Priority.IDLE, reply_job), with_priority(Priority.IDLE, nudge_job)
+    futures = [idle_pool.submit(reply_job, sp, tg) for sp, tg in zip(speakers, targets)]
+    if nudger is not None:
+        futures.append(idle_pool.submit(nudge_job, nudger))
+    return [f.result() for f in futures]
+
+GROUP_TURN_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "speaker":         {"type": "string"},
+                "text":            {"type": "string"},
+                "emotion_update":  {"type": "boolean"},
+                "emotional_state": {"type": "integer"},
+            },
+            "required": ["speaker", "text", "emotion_update", "emotional_state"],
+        },
+    },
+}
+
+def build_group_prompt(speakers, nudger, history) -> str:
+    """One prompt for a whole idle round: compact cast sheet + shared history."""
+    order = speakers + ([nudger] if nudger is not None else [])
+    cast  = "\n".join(
+        f"- {n.name}: traits {n.personality_data.get('traits', n.personality)}; "
+        f"tone {n.personality_data.get('tone', 'natural')}; "
+        f"attitude {n.personality_data.get('attitude', 'thoughtful')}; "
+        f"interests {', '.join(n.interests[:5])}; mood {n.emotional_state}/10"
+        for n in dict.fromkeys(order))
+    lines = "\n".join(f"{i}. {n.name}" for i, n in enumerate(order, start=1))
+    nudge = (f"The last line, by {nudger.name}, is ONE short remark or question (under 30 words) "
+             "that invites the user to reply.\n") if nudger is not None else ""
+    return f"""
+You are writing the next lines of a small-group conversation about "{topic}". The user has gone quiet.
+Characters (real people, never AIs):
+{cast}
+
+Conversation so far (latest last):
+{history_block(history, "group")}
+
+Write exactly these lines, in this order:
+{lines}
+Each reply reacts to the conversation in that character's own voice: 1-2 short, simple sentences, first person, natural when read aloud by text-to-speech, no stage directions.
+{nudge}Mood scale: 1 (delighted) … 5 (concerned) … 10 (devastated). Set emotion_update to true only if the conversation changes that character's mood, and give the new emotional_state.
+Return STRICT JSON: [{{"speaker": "<name>", "text": "<line>", "emotion_update": <true|false>, "emotional_state": <integer 1-10>}}, ...]
+""".strip()
+
+def parse_group_turn(raw: str, order: list) -> list[tuple[str, bool, int]]:
+    """Match JSON lines to <order> as an ordered subsequence; raises if any line is missing."""
+    data = json.loads(raw)
+    if not isinstance(data, list):
+        raise ValueError("group turn is not a JSON array")
+    lines, out = iter(data), []
+    for npc in order:
+        for line in lines:
+            text = str(line.get("text", "")).strip() if isinstance(line, dict) else ""
+            if text and str(line.get("speaker", "")).strip().lower() == npc.name.lower():
+                state = max(1, min(10, int(line.get("emotional_state", npc.emotional_state))))
+                out.append((text, bool(line.get("emotion_update")), state))
+                break
+        else:
+            raise ValueError(f"no line for {npc.name}")
+    return out
+
+def _plan_group_round(speakers, targets, nudger, history) -> list[dict]:
+    """Whole idle round from one LLM call; TTS for the lines still fans out."""
+    order = speakers + ([nudger] if nudger is not None else [])
+    raw   = llm.generate(build_group_prompt(speakers, nudger, history),
+                         profile="group", generation_config=GROUP_TURN_CONFIG).text
+    lines = parse_group_turn(raw, order)
+    idle_stats["group_rounds"] += 1
+
+    turns = []
+    for i, (npc, (text, update, state)) in enumerate(zip(order, lines)):
+        entry = {"speaker": npc.name, "text": text}
+        if i < len(speakers):
+            turns.append({"kind": "reply", "npc": npc, "entry": entry, "target": targets[i],
+                          "state": state if update else None})
+        else:
+            turns.append({"kind": "nudge", "npc": npc, "entry": entry, "state": None})
+
+    def finish(t):
+        if t["kind"] == "reply":
+            utterance_vec(t["entry"])
+        t["audio"] = tts_for(t["npc"], t["entry"]["text"])
+        return t
+    return list(idle_pool.map(with_priority(Priority.IDLE, finish), turns))
+
+def commit_idle_round(turns: list[dict]) -> list[dict]:
+    """Apply a planned round to the live conversation; returns /idle responses."""
+    global current_turn, last_speaker
+    responses = []
+    for t in turns:
+        npc, entry = t["npc"], t["entry"]
+        if t["state"] is not None:
+            npc.emotional_state = t["state"]
+        conversation.append(entry)
+        npc.last_spoken = current_turn
+        if t["kind"] == "reply":
+            update_relationship(npc, t["target"], entry["text"])
+            update_npc_to_npc_relationships(npc.name, entry["text"], utterance_vec(entry))
+            last_speaker = npc.name
+        else:
+            print(f"[IDLE-NUDGE] {npc.name}: {entry['text']}")
+        current_turn += 1
+        responses.append({"speaker": npc.name, "text": entry["text"], "audio": t["audio"]})
+    compact_history()
+    return responses
+
+def start_idle_speculation():
+    """Pre-generate the next idle round in the background (once per conversation state)."""
+    global _idle_spec
+    key = _conversation_key()
+    with _idle_lock:
+        if _idle_spec is not None and _idle_spec[0] == key:
+            return
+        if _idle_spec is not None:
+            _idle_spec[1].cancel()
+            idle_stats["discarded"] += 1
+        _idle_spec = (key, background.submit(Priority.IDLE, plan_idle_round))
+
+def cancel_idle_speculation():
+    """The user spoke / topic changed → whatever was pre-generated is stale."""
+    global _idle_spec
+    with _idle_lock:
+        if _idle_spec is not None:
+            _idle_spec[1].cancel()
+            idle_stats["discarded"] += 1
+            _idle_spec = None
+
+def take_idle_round() -> list[dict]:
+    """The speculated round if it still matches the conversation, else plan inline."""
+    global _idle_spec
+    with _idle_lock:
+        spec, _idle_spec = _idle_spec, None
+    if spec is not None and spec[0] == _conversation_key() and not spec[1].cancelled():
+        idle_stats["served_ready" if spec[1].done() else "served_waited"] += 1
+        try:
+            return spec[1].result()
+        except Exception as e:
+            print("⚠️ speculative idle round failed:", e)
+    elif spec is not None:
+        spec[1].cancel()
+        idle_stats["discarded"] += 1
+    idle_stats["inline"] += 1
+    return plan_idle_round()
+
+def generate_nudge(npc: NPC, history: list | None = None) -> str:
     """
     Ask Gemini for a brief but engaging line that:
       • fits the NPC’s stored personality & back-story
       • references or builds on the latest conversation topic
       • invites the user to respond.
     """
+    if history is None:
+        history = conversation
     personality = npc.personality_data
-    last_user   = conversation[-1]["text"] if conversation else ""
+    last_user   = history[-1]["text"] if history else ""
+    if not history and npc.opener:
+        prewarm_stats["openers_used"] += 1     # pre-warmed: text and audio already exist
+        return npc.opener
+    # same NPC, same topic, similar last lines → reuse an earlier nudge;
+    # its audio is then already in the TTS cache as well
+    scope = ("nudge", topic, npc.name)
+    vec   = context_vec(*(f"{t['speaker']}: {t['text']}" for t in history[-3:]))
+    cached = response_cache.get(scope, vec)
+    if cached is not None:
+        return cached
     prompt = (
         "You are role-playing as the NPC below in a small-group dialogue.\n"
         "NPC profile (JSON):\n"
         f"{json.dumps(personality, ensure_ascii=False, indent=2)}\n\n"
         "Conversation so far (latest last):\n"
-        + "\n".join(f"{turn['speaker']}: {turn['text']}" for turn in conversation[-10:]) +
+        + history_block(history, "nudge") +
         "\n\n"
         "The user seems idle. Craft ONE short, engaging remark or question—"
         "something that would naturally come from this NPC, relevant to the "
         "ongoing topic, and likely to prompt the user to reply. Keep it "
         "under 30 words, first-person, no stage directions."
     )
-    return gemini_model.generate_content(prompt).text.strip()
+    nudge = llm.generate(prompt, profile="nudge").text.strip()
+    response_cache.put(scope, vec, nudge)
+    return nudge
 
 if __name__ == "__main__":
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":   # the reloader's serving child, not its watcher
+        start_prewarmer()
     app.run(debug=True)
\ No newline at end of file